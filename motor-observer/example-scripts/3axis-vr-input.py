@@ -7,6 +7,12 @@
 # 4. Type vri = Vri() to start tracking and solving the assembly (to stop type: vri.stop())
 # 5. On the Pi execute sudo ./udp_receiver -min_degs_per_second 0
 # 6. The arm will only move when the controller trigger is pressed
+# Controller poses are sampled on a separate thread at sample_rate, the assembly is solved at most every solve_interval ms
+# and only if the target moved more than solve_threshold mm, type vri.stats() to see solve times and skipped solves
+# Poses can be recorded: vri = Vri(record_path = '/home/user/poses.csv') and the file saved on vri.stop()
+# The recorded file can replace the controller, also without SteamVR, in FreeCADCmd, to benchmark the pipeline:
+# vri = Vri(RecordedPoseSource('/home/user/poses.csv'))          # in FreeCAD, instead of the controller
+# vri = Vri(RecordedPoseSource('/home/user/poses.csv', loop = False), timers = False); vri.run_for(10); vri.stats(); vri.stop() # headless
 
 # ***************************************************************************
 # *                                                                         *
@@ -30,15 +36,28 @@
 # *                                                                         *
 # ***************************************************************************
 
-import FreeCAD as App, FreeCADGui as Gui, Part, time, sys, math
-from PySide2 import QtGui, QtCore
-import UtilsAssembly
-from pivy import coin
-import openvr
+import FreeCAD as App, Part, time, math
+from PySide2 import QtCore
 import struct
 import socket
 import time
 import platform
+import bisect
+import threading
+import csv
+
+if App.GuiUp:
+    import UtilsAssembly
+try:
+    import openvr
+except ImportError: # recorded poses still work
+    openvr = None
+
+log_level = 1 # 0 - warnings and errors only, 1 - messages, 2 - also every sent state
+
+def log_debug(msg):
+    if log_level >= 2:
+        App.Console.PrintMessage(msg)
 
 class MotorObserver:
     def __init__(self, obj):
@@ -93,64 +112,283 @@ class MotorObserver:
         h = 3
         fp.Shape = Part.makeBox(w, l, h, App.Vector(-w / 2, -l / 2, -h / 2))
 
-class Vri(object):
+# pose sources return the newest controller sample (time, position in FreeCAD coordinates in mm, trigger 0.0 - 1.0) or None
+# generation changes when devices connect or disconnect, so cached lookups can be refreshed
+class OpenVRPoseSource:
     def __init__(self):
+        self.vr = openvr.init(openvr.VRApplication_Other)
+        self.vrsystem = openvr.VRSystem()
+        self.event = openvr.VREvent_t()
+        self.generation = 0
+        self.refresh_devices()
+
+    def refresh_devices(self): # device classes are asked only when devices change
+        self.controllers = [i for i in range(1, openvr.k_unMaxTrackedDeviceCount)
+                            if self.vrsystem.getTrackedDeviceClass(i) == openvr.TrackedDeviceClass_Controller]
+        self.generation += 1
+        App.Console.PrintMessage("VR controllers: " + str(self.controllers) + "\n")
+
+    def sample(self):
+        changed = False
+        while self.vrsystem.pollNextEvent(self.event):
+            if self.event.eventType in (openvr.VREvent_TrackedDeviceActivated, openvr.VREvent_TrackedDeviceDeactivated):
+                changed = True
+        if changed:
+            self.refresh_devices()
+        poses = self.vr.getDeviceToAbsoluteTrackingPose(openvr.TrackingUniverseStanding, 0, openvr.k_unMaxTrackedDeviceCount)
+        for i in self.controllers:
+            pose = poses[i]
+            if not pose.bDeviceIsConnected or not pose.bPoseIsValid:
+                continue
+            controllerPose = pose.mDeviceToAbsoluteTracking
+            result, pControllerState = self.vrsystem.getControllerState(i)
+            trigval = pControllerState.rAxis[1].x # trgger value 0.0 - 1.0
+            # very simple CS transformation, since we don't need Rotation in this example
+            # adjust for your LH placement, meters to milimeters
+            fc_trans = App.Vector(-controllerPose[2][3], -controllerPose[0][3], controllerPose[1][3]) * 1000
+            return time.monotonic(), fc_trans, trigval
+        return None
+
+    def close(self):
+        openvr.shutdown()
+
+# poses recorded with Vri(record_path = ...), rows: time (s), x, y, z (mm), trigger
+class RecordedPoseSource:
+    def __init__(self, path, loop = True):
+        self.rows = []
+        with open(path, newline = "") as f:
+            for row in csv.reader(f):
+                if row and row[0] != "time":
+                    self.rows.append([float(v) for v in row])
+        if not self.rows:
+            raise ValueError("No poses in " + str(path))
+        self.times = [row[0] - self.rows[0][0] for row in self.rows]
+        self.loop = loop
+        self.generation = 0
+        self.start = None
+
+    def duration(self):
+        return self.times[-1]
+
+    def sample(self):
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        t = now - self.start
+        if self.loop and self.duration() > 0:
+            t = t % self.duration()
+        row = self.rows[max(0, bisect.bisect_right(self.times, t) - 1)]
+        return now, App.Vector(row[1], row[2], row[3]), row[4]
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def save(samples, path):
+        with open(path, "w", newline = "") as f:
+            writer = csv.writer(f)
+            writer.writerow(["time", "x", "y", "z", "trigger"])
+            for t, pos, trigger in samples:
+                writer.writerow([t, pos.x, pos.y, pos.z, trigger])
+
+# samples the pose source on its own thread, only the newest sample is kept (latest-value slot)
+class PoseSampler:
+    # sampling stops when every sample fails for max_failure_time (s), eg. SteamVR was closed
+    def __init__(self, source, rate = 250, record = False, max_failure_time = 5.0):
+        self.source = source
+        self.period = 1.0 / rate
+        self.max_failure_time = max_failure_time
+        self.errors = 0
+        self.last_error = 0.0
+        self.lock = threading.Lock()
+        self.latest = None
+        self.count = 0 # samples taken, identifies the newest one
+        self.recorded = [] if record else None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def run(self):
+        deadline = time.perf_counter()
+        failing_since = None
+        while not self.stopped.is_set():
+            try:
+                sample = self.source.sample()
+                failing_since = None
+            except Exception as e:
+                sample = None
+                self.errors += 1
+                now = time.perf_counter()
+                if now - self.last_error > 1.0: # do not flood the report view
+                    App.Console.PrintError("Pose sampling failed: " + str(e) + "\n")
+                    self.last_error = now
+                if failing_since is None:
+                    failing_since = now
+                elif now - failing_since > self.max_failure_time:
+                    App.Console.PrintError("Pose sampling stopped after " + str(self.errors) + " failures\n")
+                    self.stopped.set()
+                    break
+            if sample is not None:
+                with self.lock:
+                    self.latest = sample
+                    self.count += 1
+                if self.recorded is not None:
+                    self.recorded.append(sample)
+            deadline += self.period
+            delay = deadline - time.perf_counter()
+            if delay < 0: # late, do not try to catch up
+                deadline = time.perf_counter()
+            elif self.stopped.wait(delay):
+                break
+
+    def get(self): # (count, sample), count changes with every new sample
+        with self.lock:
+            return self.count, self.latest
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+# sends the newest states on its own thread, so name resolution or a slow network do not block solving
+# states not sent yet are replaced by newer ones
+class StateSender:
+    def __init__(self, function):
+        self.function = function
+        self.condition = threading.Condition()
+        self.latest = None # arguments of the newest states
+        self.stopped = False
+        self.sent = 0
+        self.errors = 0
+        self.last_error = 0.0
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def publish(self, *args):
+        with self.condition:
+            self.latest = args
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and self.latest is None:
+                    self.condition.wait()
+                if self.latest is None: # stopped and nothing left to send
+                    break
+                args, self.latest = self.latest, None
+            try:
+                self.function(*args)
+                self.sent += 1
+            except OSError as e:
+                self.errors += 1
+                now = time.monotonic()
+                if now - self.last_error > 1.0: # do not flood the report view
+                    App.Console.PrintError("Sending failed: " + str(e) + "\n")
+                    self.last_error = now
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join(1.0)
+
+class Vri(object):
+    def __init__(self, source = None, sample_rate = 250, solve_interval = 50, solve_threshold = 0.5, record_path = None, timers = True):
         default_remote = '192.168.1.23' # edit this adress if you are running remote Raspberry Pi as backend
         if (platform.machine() == 'armv7l') or (platform.machine() == 'aarch64'): # assumes running on Pi that drives steppers directly
             self.adr = '127.0.0.1'
         else:
             self.adr = default_remote
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.vr = openvr.init(openvr.VRApplication_Other)
-        self.vrsystem = openvr.VRSystem()
-        self.poses = []  # will be populated with proper type after first call
+        self.sender = StateSender(self.transmit_states_udp)
+        self.resolved = (None, None) # (adr, address for sendto), resolved again when adr changes
+        try:
+            self.motor_stats = motor_stats # solve times shown by mo_stats() if motor-observer.py is loaded
+        except NameError:
+            self.motor_stats = None
+        self.solve_total = 0.0
+        self.solve_max = 0.0
+        self.solve_threshold = solve_threshold # mm, smaller moves of the target are not solved
+        self.record_path = record_path
+        self.source = source if source is not None else OpenVRPoseSource()
+        self.sampler = PoseSampler(self.source, sample_rate, record_path is not None)
+        self.generation = None
+        self.last_sample = 0
+        self.last_target = None
+        self.solves = 0
+        self.skipped = 0 # samples not solved, target moved less than solve_threshold
         App.Console.PrintMessage('init')
         App.ActiveDocument.recompute()
-        self.base_transl = coin.SbVec3f()
+        self.base_transl = App.Vector()
         self.timer = QtCore.QTimer()
-        QtCore.QObject.connect(self.timer, QtCore.SIGNAL("timeout()"), self.placement_update)
-        self.timer.start(100)
         self.timer_states = QtCore.QTimer()
-        QtCore.QObject.connect(self.timer_states, QtCore.SIGNAL("timeout()"), self.states_update)
-        time.sleep(0.1)
-        self.timer_states.start(500) # states updated slower than asm for less stepper jitter
-        App.Console.PrintMessage('timers started')
+        self.timer.timeout.connect(self.placement_update)
+        self.timer_states.timeout.connect(self.states_update)
+        self.solve_interval = solve_interval
+        if timers:
+            self.timer.start(solve_interval)
+            self.timer_states.start(500) # states updated slower than asm for less stepper jitter
+            App.Console.PrintMessage('timers started')
 
-    def extracttranslation(self, transfmat):
-        pos = coin.SbVec3f(transfmat[0][3], transfmat[1][3], transfmat[2][3])
-        return pos
+    # object lookups are cached and refreshed when devices connect or disconnect
+    def refresh_lookups(self):
+        doc = App.ActiveDocument
+        self.moving_obj = doc.getObjectsByLabel("GroundedSphereJoint")[0]
+        self.assembly = None
+        if App.GuiUp:
+            self.assembly = UtilsAssembly.activeAssembly()
+        if not self.assembly: # headless, the first assembly of the document
+            self.assembly = next((obj for obj in doc.Objects if obj.TypeId == 'Assembly::AssemblyObject'), None)
+        self.generation = self.source.generation
+        self.last_target = None
 
     def placement_update(self):
-        self.poses = self.vr.getDeviceToAbsoluteTrackingPose(openvr.TrackingUniverseStanding, 0, openvr.k_unMaxTrackedDeviceCount)
-        for i in range(1, len(self.poses)):
-            pose = self.poses[i]
-            if not pose.bDeviceIsConnected:
-                continue
-            if not pose.bPoseIsValid:
-                continue
-            device_class = openvr.VRSystem().getTrackedDeviceClass(i)
-            if not device_class == openvr.TrackedDeviceClass_Controller:
-                continue
-            controllerPose = pose.mDeviceToAbsoluteTracking
-            result, pControllerState = self.vrsystem.getControllerState(i)
-            conpos = self.extracttranslation(controllerPose) * 1000 # meters to milimeters
-            trigval = pControllerState.rAxis[1].x # trgger value 0.0 - 1.0
-            # very simple CS transformation, since we don't need Rotation in this example
-            # adjust for your LH placement
-            fc_trans = App.Vector(-conpos[2], -conpos[0], conpos[1])
-            # moving_obj = App.ActiveDocument.getObject('Box')
-            moving_obj = App.ActiveDocument.getObjectsByLabel("GroundedSphereJoint")[0]
-            if trigval < 0.5: # if trigger not pressed, change placement offset
-                self.base_transl = fc_trans - moving_obj.Placement.Base
-            else:
-                moving_obj.Placement=App.Placement((fc_trans - self.base_transl), App.Rotation())
-            assembly = UtilsAssembly.activeAssembly()
-            if not assembly:
-                return
-            assembly.solve()
+        count, sample = self.sampler.get()
+        if sample is None or count == self.last_sample:
+            return
+        self.last_sample = count
+        if self.generation != self.source.generation:
+            self.refresh_lookups()
+        t, fc_trans, trigval = sample
+        if trigval < 0.5: # if trigger not pressed, change placement offset
+            self.base_transl = fc_trans - self.moving_obj.Placement.Base
+            return
+        target = fc_trans - self.base_transl
+        if self.last_target is not None and (target - self.last_target).Length < self.solve_threshold:
+            self.skipped += 1
+            return
+        self.moving_obj.Placement = App.Placement(target, App.Rotation())
+        self.last_target = target
+        if not self.assembly:
+            return
+        start = time.perf_counter()
+        self.assembly.solve()
+        solve_time = time.perf_counter() - start
+        self.solve_total += solve_time
+        self.solve_max = max(self.solve_max, solve_time)
+        if self.motor_stats:
+            self.motor_stats.record("vr_solve", solve_time)
+        self.solves += 1
+
+    # without the Qt event loop (FreeCADCmd), updates are driven here for duration seconds
+    def run_for(self, duration):
+        end = time.monotonic() + duration
+        next_states = time.monotonic()
+        while time.monotonic() < end:
+            self.placement_update()
+            if time.monotonic() >= next_states:
+                self.states_update()
+                next_states += 0.5
+            time.sleep(self.solve_interval / 1000)
+
+    def observers(self):
+        try:
+            return observer_registry.observers() # cached by motor-observer.py, if it is loaded
+        except NameError:
+            return App.ActiveDocument.findObjects(Label = "MotorObserver")
 
     def states_update(self):
-            observers = App.ActiveDocument.findObjects(Label="MotorObserver")
+            observers = self.observers()
             states_for_send = []
             for iden, obs in enumerate(observers):
                 state = [bool(obs.Enabled), float(obs.TransfAngle.Value)]
@@ -158,24 +396,50 @@ class Vri(object):
                     states_for_send.append(state)
                 else:
                     App.Console.PrintError(str(obs.Label) + "not added, max 3 motors per group allowed!\n")
-                App.Console.PrintMessage(str(obs.Label) + " " + str(state) + "\n")
+                log_debug(str(obs.Label) + " " + str(state) + "\n")
             while len(states_for_send) < 3:
                 iden = len(states_for_send)
                 states_for_send.append([False, 0.0])
-                App.Console.PrintMessage("Dummy" + str(iden) + "motor added for padding\n")
+                log_debug("Dummy" + str(iden) + "motor added for padding\n")
             self.send_states_udp(states_for_send)
 
+    # the states are only handed over to the sender thread
     def send_states_udp(self, states_for_send):
+        self.sender.publish(states_for_send)
+
+    def transmit_states_udp(self, states_for_send):
         format_string = "?f" * len(states_for_send)
         packed_states = struct.pack(format_string, *(item for sublist in states_for_send for item in sublist))
         if (self.sock and not self.sock._closed):
-            App.Console.PrintMessage("States changed, sending MotorObservers\n")
-            sent = self.sock.sendto(packed_states, (self.adr, 7755))
+            log_debug("States changed, sending MotorObservers\n")
+            adr, target = self.resolved
+            if adr != self.adr:
+                target = socket.getaddrinfo(self.adr, 7755, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+                self.resolved = (self.adr, target)
+            try:
+                sent = self.sock.sendto(packed_states, target)
+            except OSError:
+                self.resolved = (None, None)
+                raise
+
+    def stats(self):
+        count, sample = self.sampler.get()
+        App.Console.PrintMessage("Pose samples: " + str(count) + ", solves: " + str(self.solves) + ", skipped small moves: " + str(self.skipped)
+                                 + ", datagrams sent: " + str(self.sender.sent) + ", send errors: " + str(self.sender.errors) + "\n")
+        if self.solves:
+            App.Console.PrintMessage("Solve time: mean " + str(round(self.solve_total / self.solves * 1000, 3)) + " ms, max "
+                                     + str(round(self.solve_max * 1000, 3)) + " ms\n")
 
     def stop(self):
         self.timer.stop()
-        openvr.shutdown()
+        self.timer_states.stop()
+        self.sampler.stop()
+        self.source.close()
+        self.sender.stop()
         self.sock.close()
+        if self.record_path:
+            RecordedPoseSource.save(self.sampler.recorded, self.record_path)
+            App.Console.PrintMessage("Poses saved to " + str(self.record_path) + "\n")
 
 # vri = Vri() # paste without comment to start
 
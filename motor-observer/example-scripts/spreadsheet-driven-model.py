@@ -1,54 +1,239 @@
 # Script showing driving assembly movement with spreadsheet
 # Can be combined with motor-observer.py for driving stepper motors, motor-observer.py have to be loaded before this script
 # Use spreadsheet-example-deltarobot.FCStd as example input model
+# The program is read once, plate position is interpolated between rows at control_rate,
+# type stop_program() to stop and play_program() to start again
+#
+# The program can also be baked offline into a motor trajectory file, every row is solved once,
+# without the solver in the real-time loop. It works in FreeCADCmd without GUI:
+# exec(open('motor-observer.py').read())
+# exec(open('spreadsheet-driven-model.py').read())
+# App.openDocument('spreadsheet-example-deltarobot.FCStd')
+# bake_program('/home/user/delta.motraj') # or bake_program('/home/user/delta.motraj', rate = 50) for interpolated poses
+# and later, in FreeCAD connected to the motors:
+# load_states('/home/user/delta.motraj')
+# replay_states()
+#
+# With an inverse kinematics table motors are driven from interpolated angles and the solver only updates the view:
+# build_ik_table('PlatePosition', (-50, -50, -150), (50, 50, -100), 10, '/home/user/delta.iktable') # once, see ik_table_error()
+# play_program(use_ik = True)
 
 import FreeCAD as App
-import FreeCADGui as Gui
 from PySide2 import QtCore
+import hashlib
+import re
+import time
+import json
+import os
+import numpy as np
 
-timer_pose = QtCore.QTimer()
-timer_pose.setSingleShot(True)
-timer_pose.setInterval(0)
+if App.GuiUp:
+    import FreeCADGui as Gui
 
 initial_row = 2
-row_idx = initial_row
-end_of_data = False
 looped = False
+control_rate = 50 # Hz, plate position updates during playback
+profile = 'linear' # 'linear' or 'smooth', smooth starts and stops at every waypoint with zero velocity
+visual_rate = 10 # Hz, assembly solves for the view when motors are driven from the IK table
+
+# the whole program is read once, every row holds x, y, z of a waypoint and D - time of moving to the next waypoint
+# with looped = False D of the last row is the time of holding the last waypoint
+def read_rows(sheet):
+    rows = []
+    idx = initial_row
+    while True:
+        try:
+            row = [sheet.get(col + str(idx)) for col in "ABCD"]
+        except: # empty cell, end of data
+            break
+        if not all(isinstance(v, (int, float)) for v in row):
+            App.Console.PrintMessage("Not a number at row: " + str(idx) + " breaking\n")
+            break
+        rows.append(row)
+        idx = idx + 1
+    return rows
+
+class Program:
+    def __init__(self, rows, loop = False, smooth = False):
+        self.rows = rows
+        table = np.array(rows, dtype = float).reshape(-1, 4)
+        self.starts = table[:, :3]
+        self.durations = table[:, 3]
+        if loop: # the last row moves back to the first waypoint
+            self.ends = np.vstack((self.starts[1:], self.starts[:1]))
+        else:
+            self.ends = np.vstack((self.starts[1:], self.starts[-1:]))
+        self.times = np.concatenate(([0.0], np.cumsum(self.durations))) # waypoint i is left at times[i]
+        self.smooth = smooth
+
+    def duration(self):
+        return float(self.times[-1])
 
-pos = [0, 0, 0]
+    def max_velocity(self): # mm/s, peak of the smooth profile is 1.5 of the linear one
+        lengths = np.linalg.norm(self.ends - self.starts, axis = 1)
+        moving = self.durations > 0
+        velocity = (lengths[moving] / self.durations[moving]).max() if moving.any() else 0.0
+        return velocity * 1.5 if self.smooth else velocity
 
+    def positions_at(self, t): # t is an array of times from the program start
+        idx = np.clip(np.searchsorted(self.times, t, side = 'right') - 1, 0, len(self.durations) - 1)
+        span = self.durations[idx]
+        ratio = np.where(span > 0, (t - self.times[idx]) / np.where(span > 0, span, 1.0), 1.0)
+        ratio = np.clip(ratio, 0.0, 1.0)
+        if self.smooth:
+            ratio = ratio * ratio * (3.0 - 2.0 * ratio)
+        return self.starts[idx] + ratio[:, None] * (self.ends[idx] - self.starts[idx])
+
+def read_program(sheet):
+    rows = read_rows(sheet)
+    if not rows:
+        App.Console.PrintError("No program rows in the spreadsheet\n")
+        return None
+    if any(row[3] < 0 for row in rows):
+        App.Console.PrintError("Negative duration at row: " + str(initial_row + [row[3] < 0 for row in rows].index(True)) + "\n")
+        return None
+    program = Program(rows, looped, profile == 'smooth')
+    App.Console.PrintMessage("Program: " + str(len(rows)) + " waypoints, " + str(round(program.duration(), 2)) + " s, max velocity "
+                             + str(round(program.max_velocity(), 1)) + " mm/s\n")
+    return program
+
+def set_plate_position(plate, position):
+    plate.Placement = App.Placement(App.Vector(*position),App.Rotation(App.Vector(0,0,1),0)) # modyfying fixed joint
+
+timer_pose = QtCore.QTimer()
+timer_pose.setInterval(int(1000 / control_rate))
+
+program = None
+plate = None
+play_start = 0.0
+use_ik_table = False
+last_visual = 0.0
+immediate_send_saved = True
+
+# plate position is interpolated between waypoints at control_rate, times are counted from the start, so they do not drift
 def update_pose():
-    global end_of_data, row_idx # required if triggered by timer
-    if not end_of_data:
+    global play_start, last_visual
+    t = time.monotonic() - play_start
+    end = False
+    if t >= program.duration():
+        if looped:
+            play_start = play_start + program.duration()
+            t = t - program.duration()
+        else:
+            t = program.duration()
+            end = True
+    position = program.positions_at(np.array([t]))[0].tolist()
+    if use_ik_table:
+        ik_send(position)
+    if not use_ik_table or end or time.monotonic() - last_visual >= 1.0 / visual_rate:
+        last_visual = time.monotonic()
+        set_plate_position(plate, position)
+        Gui.runCommand('Assembly_SolveAssembly',0) # update other joint - solve asm
+    if end:
+        stop_program()
+        App.Console.PrintMessage("End of program\n")
+
+# use_ik - motor angles are interpolated from ik_table (build_ik_table() or load_ik_table() of motor-observer.py)
+def play_program(rate = None, use_ik = False):
+    global program, plate, play_start, use_ik_table, immediate_send_saved, immediate_send_enabled
+    stop_program()
+    program = read_program(App.ActiveDocument.Spreadsheet)
+    if program is None:
+        return
+    if use_ik:
+        if ik_table is None:
+            App.Console.PrintError("No IK table, use build_ik_table() or load_ik_table() first\n")
+            return
+        outside = np.isnan(ik_table.interpolate(program.positions_at(np.linspace(0.0, program.duration(), 1000)))).any(axis = 1)
+        if outside.any():
+            App.Console.PrintWarning("The program leaves the IK table, these motor positions are skipped\n")
+        immediate_send_saved = immediate_send_enabled
+        immediate_send_enabled = False # observers follow the view only
+    use_ik_table = use_ik
+    plate = App.ActiveDocument.getObjectsByLabel('PlatePosition')[0]
+    timer_pose.setInterval(int(1000 / (rate or control_rate)))
+    play_start = time.monotonic()
+    timer_pose.start()
+
+def stop_program():
+    global use_ik_table, immediate_send_enabled
+    timer_pose.stop()
+    if use_ik_table:
+        use_ik_table = False
+        immediate_send_enabled = immediate_send_saved
+
+# properties which are results of solving or only change the view, they do not change a baked program
+volatile_properties = {"Shape", "Visibility", "Label2", "TransfAngle", "ContinuousAngle", "Velocity"}
+
+# a property value as JSON friendly data, links by object name, placements rounded below the solver noise
+def state_value(value):
+    if hasattr(value, "TypeId") and hasattr(value, "Name"): # linked document object
+        return value.Name
+    if hasattr(value, "Base") and hasattr(value, "Rotation"): # Placement
+        return [round(v, 6) for v in (value.Base.x, value.Base.y, value.Base.z) + tuple(value.Rotation.Q)]
+    if hasattr(value, "Q"): # Rotation
+        return [round(v, 6) for v in value.Q]
+    if hasattr(value, "Value"): # Quantity
+        return round(value.Value, 6)
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, (bool, int, str)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [state_value(v) for v in value]
+    return re.sub(" at 0x[0-9a-fA-F]+", "", str(value)) # no memory addresses in the key
+
+# the inputs of the open document (observer settings, joints, parameters of all objects, placements of grounded parts, also unsaved)
+# and the spreadsheet rows identify a baked program
+# placements of other parts and observers are solver results, the plate placement is set by every baked pose, they are left out,
+# so playing the program or dragging parts between bakes does not force a new bake
+def program_hash(doc, rows, rate, plate_label = 'PlatePosition'):
+    grounded = {obj.ObjectToGround.Name for obj in doc.Objects if getattr(obj, "ObjectToGround", None) is not None}
+    digest = hashlib.sha256()
+    for obj in sorted(doc.Objects, key = lambda obj: obj.Name):
+        skipped = volatile_properties if obj.Name in grounded and obj.Label != plate_label else volatile_properties | {"Placement"}
+        props = {name: state_value(obj.getPropertyByName(name)) for name in obj.PropertiesList if name not in skipped}
+        digest.update(json.dumps([obj.Name, obj.TypeId, props], sort_keys = True).encode())
+    digest.update(json.dumps([rows, looped, profile, rate, wire_continuous, wire_velocity]).encode())
+    return digest.hexdigest()
+
+# solve every waypoint once and save observer angles as a timed trajectory for replay_states()
+# with rate (Hz) poses interpolated between waypoints are solved, like during playback
+# an unchanged program is not solved again, unless use_cache is False
+def bake_program(out_path, doc = None, use_cache = True, rate = None):
+    doc = doc or App.ActiveDocument
+    program = read_program(doc.Spreadsheet)
+    if program is None:
+        return None
+    key = program_hash(doc, program.rows, rate)
+    if use_cache and os.path.exists(out_path):
         try:
-            pos[0] = App.ActiveDocument.Spreadsheet.get("A"+str(row_idx))
-            pos[1] = App.ActiveDocument.Spreadsheet.get("B"+str(row_idx))
-            pos[2] = App.ActiveDocument.Spreadsheet.get("C"+str(row_idx))
-            for p in pos:
-                is_num = isinstance(p, (int, float))
-                if not is_num:
-                    App.Console.PrintMessage("Position not a number at row: " + str(row_idx) + " breaking\n")
-                    return
-            duration = App.ActiveDocument.Spreadsheet.get("D"+str(row_idx))
-            is_num = isinstance(duration, (int, float))
-            if not is_num:
-                App.Console.PrintMessage("Duration not a number at row: " + str(row_idx) + " breaking\n")
-                return
-            print (pos)
-            App.ActiveDocument.getObjectsByLabel('PlatePosition')[0].Placement = App.Placement(App.Vector(pos),App.Rotation(App.Vector(0,0,1),0)) # modyfying fixed joint
-            Gui.runCommand('Assembly_SolveAssembly',0) # update other joint - solve asm
-            timer_pose.setInterval(duration * 1000)
-            timer_pose.start()
-            row_idx = row_idx + 1
-        except:
-            if looped:
-                row_idx = initial_row
-                duration = App.ActiveDocument.Spreadsheet.get("D"+str(row_idx))
-                timer_pose.setInterval(duration * 1000)
-                timer_pose.start()
-            else:
-                end_of_data = True
-                App.Console.PrintMessage("End of data at row: " + str(row_idx) + " ending\n")
+            cached = TrajectoryStore.load(out_path)
+            if cached.meta.get("program_hash") == key:
+                App.Console.PrintMessage("Program not changed, using " + str(out_path) + "\n")
+                return cached
+        except (OSError, ValueError):
+            pass
+    plate = doc.getObjectsByLabel('PlatePosition')[0]
+    store = TrajectoryStore()
+    store.meta["program_hash"] = key
+    if rate:
+        times = np.append(np.arange(0.0, program.duration(), 1.0 / rate), program.duration())
+    else:
+        times = program.times
+    positions = program.positions_at(times)
+    start = time.perf_counter()
+    with solving_offline(doc, plate): # solve_assemblies() and solving_offline() of motor-observer.py
+        for timestamp, position in zip(times.tolist(), positions.tolist()):
+            set_plate_position(plate, position)
+            solve_assemblies(doc)
+            states_for_send, targets = collect_states(observer_registry.observers(doc))
+            store.append(states_for_send, timestamp)
+            store.targets = targets
+    store.save(out_path)
+    App.Console.PrintMessage("Baked " + str(len(times)) + " poses in " + str(round(time.perf_counter() - start, 2)) + " s to " + str(out_path) + "\n")
+    return store
 
 timer_pose.timeout.connect(update_pose)
-timer_pose.start()
+if App.GuiUp:
+    play_program()
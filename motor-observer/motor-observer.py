@@ -30,10 +30,262 @@ import struct
 import socket
 import time
 import platform
+import random
+import json
+import os
+import threading
+import bisect
+import contextlib
+import csv
+import numpy as np
 
-recorded_states = []
+# recorded frames as fixed width records: timestamp (s), enable bits and float32 angles of every motor
+# max_frames > 0 turns the store into a ring buffer keeping only the newest frames
+# saved files have a small header followed by raw records, so they can be memory mapped for replay
+class TrajectoryStore:
+    magic = b"MOTRAJ\x00\x01"
+    header_format = "<8sHHI" # magic, motor count, reserved, metadata size
+
+    def __init__(self, max_frames = 0):
+        self.max_frames = max_frames
+        self.targets = [] # receiver of each 3 motor group
+        self.meta = {} # extra metadata saved with the states
+        self.clear()
+
+    @staticmethod
+    def record_dtype(motor_count):
+        return np.dtype([("time", "<f8"), ("enabled", "<u8"), ("angles", "<f4", (motor_count,))])
+
+    def clear(self):
+        self.motor_count = 0
+        self.records = np.zeros(0, dtype = self.record_dtype(0))
+        self.first = 0 # oldest frame index, moves when the ring buffer is full
+        self.count = 0
+        self.start_time = None
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "TrajectoryStore(" + str(self.count) + " frames, " + str(self.motor_count) + " motors)"
+
+    def __getitem__(self, iden):
+        if iden < 0:
+            iden += self.count
+        if not 0 <= iden < self.count:
+            raise IndexError("frame index out of range")
+        record = self.records[(self.first + iden) % len(self.records)]
+        bits = int(record["enabled"])
+        return [[bool(bits >> motor & 1), angle] for motor, angle in enumerate(record["angles"].tolist())]
+
+    def __iter__(self):
+        for iden in range(self.count):
+            yield self[iden]
+
+    def time(self, iden): # timestamp of a frame, in seconds from the start of recording
+        return float(self.records["time"][(self.first + iden) % len(self.records)])
+
+    def subset(self, mask):
+        store = TrajectoryStore()
+        store.targets = list(self.targets)
+        store.meta = dict(self.meta)
+        store.motor_count = self.motor_count
+        store.records = np.array(self.frames()[mask])
+        store.count = len(store.records)
+        return store
+
+    def frames(self): # records in chronological order
+        if self.first:
+            return np.concatenate((self.records[self.first:], self.records[:self.first]))
+        return self.records[:self.count]
+
+    def set_max_frames(self, max_frames):
+        frames = self.frames()
+        if max_frames and len(frames) > max_frames:
+            frames = frames[-max_frames:]
+        self.max_frames = max_frames
+        self.records = np.array(frames)
+        self.first = 0
+        self.count = len(frames)
+
+    def resize(self, motor_count): # more motors than before, earlier frames get disabled padding motors
+        frames = self.frames()
+        records = np.zeros(max(len(frames), 16), dtype = self.record_dtype(motor_count))
+        records["time"][:len(frames)] = frames["time"]
+        records["enabled"][:len(frames)] = frames["enabled"]
+        records["angles"][:len(frames), :self.motor_count] = frames["angles"]
+        self.motor_count = motor_count
+        self.records = records
+        self.first = 0
+
+    def append(self, states, timestamp = None):
+        now = time.monotonic()
+        if self.start_time is None: # first frame, or appending to a loaded recording, continue from the last timestamp
+            self.start_time = now - (float(self.records["time"][(self.first + self.count - 1) % len(self.records)]) if self.count else 0.0)
+        if timestamp is None:
+            timestamp = now - self.start_time
+        if len(states) > self.motor_count:
+            self.resize(len(states))
+        elif not self.records.flags.writeable: # memory mapped file
+            self.records = np.array(self.records)
+        if self.max_frames:
+            if len(self.records) != self.max_frames:
+                self.set_max_frames(self.max_frames)
+                records = np.zeros(self.max_frames, dtype = self.records.dtype)
+                records[:self.count] = self.records
+                self.records = records
+            iden = (self.first + self.count) % self.max_frames
+            if self.count == self.max_frames:
+                self.first = (self.first + 1) % self.max_frames
+            else:
+                self.count += 1
+        else:
+            if self.count == len(self.records):
+                records = np.zeros(max(16, 2 * self.count), dtype = self.records.dtype)
+                records[:self.count] = self.records[:self.count]
+                self.records = records
+            iden = self.count
+            self.count += 1
+        bits = 0
+        angles = np.zeros(self.motor_count, dtype = np.float32)
+        for motor, state in enumerate(states): # velocities of protocol 2 states are not stored
+            bits |= bool(state[0]) << motor
+            angles[motor] = state[1]
+        self.records[iden] = (timestamp, bits, angles)
+
+    # written to a temporary file replacing the target, so a file memory mapped by this or another store is never truncated
+    def save(self, path):
+        if isinstance(self.records, np.memmap) and os.path.abspath(self.records.filename) == os.path.abspath(path):
+            self.records = np.array(self.records) # the map of the replaced file is released, Windows does not replace mapped files
+        meta = json.dumps(dict(self.meta, targets = self.targets)).encode()
+        meta += b" " * (-(struct.calcsize(self.header_format) + len(meta)) % 8) # keep records aligned
+        temp_path = os.path.join(os.path.dirname(os.path.abspath(path)), "." + os.path.basename(path) + ".tmp")
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(struct.pack(self.header_format, self.magic, self.motor_count, 0, len(meta)))
+                f.write(meta)
+                self.frames().tofile(f)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path): # records stay in the file and are read through a memory map
+        header_size = struct.calcsize(cls.header_format)
+        with open(path, "rb") as f:
+            magic, motor_count, reserved, meta_size = struct.unpack(cls.header_format, f.read(header_size))
+            if magic != cls.magic:
+                raise ValueError(str(path) + " is not a trajectory file")
+            meta = json.loads(f.read(meta_size))
+        store = cls()
+        store.motor_count = motor_count
+        store.targets = [tuple(target) for target in meta.pop("targets")]
+        store.meta = meta
+        dtype = cls.record_dtype(motor_count)
+        offset = header_size + meta_size
+        count = (os.path.getsize(path) - offset) // dtype.itemsize
+        if count:
+            store.records = np.memmap(path, dtype = dtype, mode = "r", offset = offset, shape = (count,))
+        else:
+            store.records = np.zeros(0, dtype = dtype)
+        store.count = count
+        return store
+
+recorded_states = TrajectoryStore()
+
+# continuous angles (degrees) from angles in [0, 360), revolutions counted like in udp_receiver
+def unwrap_angles(angles):
+    steps = np.diff(angles, axis = 0)
+    revs = np.cumsum((steps < -180.0).astype(int) - (steps > 180.0), axis = 0)
+    return angles + 360.0 * np.concatenate((np.zeros((1,) + angles.shape[1:], dtype = int), revs))
+
+# Ramer-Douglas-Peucker over time, a frame is kept if any motor deviates more than tolerance
+# from linear interpolation between kept frames, positions are (N, motors) arrays
+# max_jump - segments where any motor moves max_jump or more are split, eg. 180 deg, because udp_receiver unwraps such jumps the short way,
+# scalar or one value per motor
+# max_gap - segments longer than max_gap (s) are split, udp_receiver spreads a packet over the time since the previous one, so a gap is also a lag
+def decimate_mask(times, positions, tolerance, max_jump = None, max_gap = None):
+    count = len(times)
+    keep = np.zeros(count, dtype = bool)
+    keep[0] = keep[-1] = True
+    segments = [(0, count - 1)]
+    while segments:
+        first, last = segments.pop()
+        if last - first < 2:
+            continue
+        span = times[last] - times[first]
+        ratio = (times[first + 1:last] - times[first]) / span if span > 0 else np.zeros(last - first - 1)
+        line = positions[first] + ratio[:, None] * (positions[last] - positions[first])
+        errors = np.abs(positions[first + 1:last] - line).max(axis = 1)
+        worst = int(np.argmax(errors))
+        jump = max_jump is not None and (np.abs(positions[last] - positions[first]) >= max_jump).any()
+        gap = max_gap is not None and span > max_gap
+        if errors[worst] > tolerance or jump or gap:
+            middle = first + 1 + worst if errors[worst] > tolerance else (first + last) // 2 # a straight jump is halved
+            keep[middle] = True
+            segments.append((first, middle))
+            segments.append((middle, last))
+    return keep
 recording_enabled = False
 immediate_send_enabled = True
+batch_angles_enabled = False # compute angles of all observers in one NumPy pass before sending, see update_angles_batch()
+log_level = 1 # 0 - warnings and errors only, 1 - messages, 2 - also every state and send, slows down sending at high rates
+
+def log_debug(msg): # messages from the send path
+    if log_level >= 2:
+        App.Console.PrintMessage(msg)
+
+# angle (radians) of the transformation from base rotation to current rotation, None if rotation is not about a single axis
+def transf_angle(rot, base_rot, support_rot, revers):
+    # if the observer is moving in 3D space it need a support object specified
+    # eg.: if observer is fixed to a motor pulley, the motor housing can used as a support object
+    # an user can set the support in the data tab inside FreeCAD window
+    if support_rot is not None:
+        transf_rot = base_rot.inverted() * support_rot.inverted() * rot
+    else:
+        transf_rot = base_rot.inverted() * rot # calculate how much rotation is transformed from initial rotation
+    axis = transf_rot.Axis
+    angle = transf_rot.Angle
+    if revers:
+        angle = 2 * math.pi - angle
+    if (axis.x > 0.99 or axis.y > 0.99 or axis.z > 0.99):
+        pass
+    elif (axis.x < -0.99 or axis.y < -0.99 or axis.z < -0.99): # reverse angle if axis -1
+        angle = 2 * math.pi - angle
+    else:
+        return None
+    return angle
+
+# quaternions are (N, 4) arrays in FreeCAD Rotation.Q order (x, y, z, w)
+def quat_mult(a, b): # same as Rotation * Rotation, including normalization
+    x0, y0, z0, w0 = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    x1, y1, z1, w1 = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    q = np.stack((w0 * x1 + x0 * w1 + y0 * z1 - z0 * y1,
+                  w0 * y1 - x0 * z1 + y0 * w1 + z0 * x1,
+                  w0 * z1 + x0 * y1 - y0 * x1 + z0 * w1,
+                  w0 * w1 - x0 * x1 - y0 * y1 - z0 * z1), axis = 1)
+    return q / np.linalg.norm(q, axis = 1)[:, None]
+
+def quat_inverted(q):
+    return q * np.array([-1.0, -1.0, -1.0, 1.0])
+
+# vectorized transf_angle(), returns angles (radians) and a mask of observers rotating about a single axis
+def transf_angles(rots, base_rots, support_rots, revers):
+    transf = quat_mult(quat_mult(quat_inverted(base_rots), quat_inverted(support_rots)), rots)
+    w = transf[:, 3]
+    inside = (w > -1.0) & (w < 1.0) # Rotation.Angle is 0 and Rotation.Axis is (0, 0, 1) outside this range
+    angles = np.where(inside, np.arccos(np.clip(w, -1.0, 1.0)) * 2.0, 0.0)
+    scale = np.sin(angles / 2.0)
+    axes = np.empty((len(transf), 3))
+    axes[inside] = transf[inside, :3] / scale[inside, None]
+    axes[~inside] = (0.0, 0.0, 1.0)
+    angles = np.where(revers, 2 * math.pi - angles, angles)
+    positive = (axes > 0.99).any(axis = 1)
+    negative = (axes < -0.99).any(axis = 1) & ~positive
+    angles = np.where(negative, 2 * math.pi - angles, angles) # reverse angle if axis -1
+    return angles, positive | negative
 
 class MotorObserver:
     def __init__(self, obj):
@@ -44,36 +296,91 @@ class MotorObserver:
         obj.addProperty("App::PropertyBool","Enabled","MotorObserver","Enable the motor").Enabled = True
         obj.addProperty("App::PropertyBool","Reversed","MotorObserver","Reverse motor direction").Reversed = False
         obj.setEditorMode("TransfAngle", 1) # this property should be read only
+        self.add_missing_properties(obj)
         obj.Proxy = self
-        self.last_state = []
+        self.last_state = [] # last sent state
+
+    # properties added after the first version of the script, also added to observers from older files
+    def add_missing_properties(self, obj):
+        # observers sharing the same receiver form a group of up to 3 motors
+        if not hasattr(obj, "ReceiverAddress"):
+            obj.addProperty("App::PropertyString","ReceiverAddress","MotorObserver","Receiver IP adress, empty for the default adr")
+        if not hasattr(obj, "ReceiverPort"):
+            obj.addProperty("App::PropertyInteger","ReceiverPort","MotorObserver","Receiver UDP port").ReceiverPort = 7755
+        # changes smaller than Deadband microsteps are not sent, defaults match udp_receiver
+        if not hasattr(obj, "StepsPerRev"):
+            obj.addProperty("App::PropertyInteger","StepsPerRev","MotorObserver","Full steps per motor revolution").StepsPerRev = 400
+        if not hasattr(obj, "UstepsPerStep"):
+            obj.addProperty("App::PropertyInteger","UstepsPerStep","MotorObserver","Microsteps (step pin level changes) per full step").UstepsPerStep = 64
+        if not hasattr(obj, "Deadband"):
+            obj.addProperty("App::PropertyFloat","Deadband","MotorObserver","Smallest sent change, in microsteps").Deadband = 1.0
+        # TransfAngle tracked over full revolutions and its filtered rate of change
+        if not hasattr(obj, "ContinuousAngle"):
+            obj.addProperty("App::PropertyAngle","ContinuousAngle","MotorObserver","Multi-turn angle, not wrapped to one revolution")
+            obj.ContinuousAngle = obj.TransfAngle.Value
+            obj.setEditorMode("ContinuousAngle", 1)
+        if not hasattr(obj, "Velocity"):
+            obj.addProperty("App::PropertyFloat","Velocity","MotorObserver","Filtered angular velocity, deg/s")
+            obj.setEditorMode("Velocity", 1)
+        if not hasattr(obj, "VelocityFilter"):
+            obj.addProperty("App::PropertyFloat","VelocityFilter","MotorObserver","Time constant of the velocity filter, s").VelocityFilter = 0.1
+
+    def onDocumentRestored(self, fp):
+        self.add_missing_properties(fp) # files saved with older versions of the script
+
+    # True if the state differs from the last sent one by at least the deadband
+    def state_changed(self, fp):
+        last_state = getattr(self, "last_state", [])
+        if not last_state or last_state[0] != bool(fp.Enabled):
+            return True
+        diff = abs(float(fp.TransfAngle.Value) - last_state[1]) % 360.0
+        diff = min(diff, 360.0 - diff)
+        return diff * fp.StepsPerRev / 360.0 * fp.UstepsPerStep >= fp.Deadband
+
+    # called with every new angle (deg), before TransfAngle is set
+    # the change since the previous angle is taken the shorter way, so a turn is lost only if observers
+    # turn more than half a revolution between two updates (solves), not between two sends
+    def track_angle(self, fp, angle):
+        now = time.monotonic()
+        delta = (angle - float(fp.TransfAngle.Value) + 180.0) % 360.0 - 180.0
+        velocity = float(fp.Velocity)
+        last_time = getattr(self, "track_time", None)
+        dt = now - last_time if last_time is not None else 0.0
+        if 0.0 < dt < 1.0:
+            alpha = dt / (fp.VelocityFilter + dt) if fp.VelocityFilter > 0 else 1.0 # first order low-pass
+            velocity += alpha * (delta / dt - velocity)
+        else: # first update or after a long pause
+            velocity = 0.0
+        self.track_time = now
+        fp.ContinuousAngle = float(fp.ContinuousAngle.Value) + delta
+        fp.Velocity = velocity
+
+    # Velocity is updated only when the observer moves, an observer at rest reports 0
+    def current_velocity(self, fp):
+        last_time = getattr(self, "track_time", None)
+        if last_time is None or time.monotonic() - last_time > max(0.2, 2 * fp.VelocityFilter):
+            return 0.0
+        return float(fp.Velocity)
 
     def onChanged(self, fp, prop):
         if (prop == "SupportObject"):
             if (fp.SupportObject):
                 App.Console.PrintMessage(str(fp.Label) + " Support: " + str(fp.SupportObject.Label) + "\n")
         if (prop == "Placement") or (prop == "Enabled"):
+            if batch_angles_enabled: # angles are computed for all observers at once before sending
+                try:
+                    if prop == "Placement":
+                        schedule_batch_tracking()
+                    trigger_sender()
+                except:
+                    App.Console.PrintMessage("No send_states() function defined!\n")
+                return
             auto_set_base_pl = False
             rot = fp.Placement.Rotation
-            base_rot = fp.BaseRotation
-            # if the observer is moving in 3D space it need a support object specified
-            # eg.: if observer is fixed to a motor pulley, the motor housing can used as a support object
-            # an user can set the support in the data tab inside FreeCAD window
-            if (fp.SupportObject):
-                support_rot = fp.SupportObject.Placement.Rotation
-                transf_rot = base_rot.inverted() * support_rot.inverted() * rot
-            else:
-                transf_rot = base_rot.inverted() * rot # calculate how much rotation is transformed from initial rotation
-            axis = transf_rot.Axis
-            angle = transf_rot.Angle
-            revers = fp.Reversed
+            support_rot = fp.SupportObject.Placement.Rotation if fp.SupportObject else None
             enbl = fp.Enabled
-            if revers:
-                angle = 2 * math.pi - angle
-            if (axis.x > 0.99 or axis.y > 0.99 or axis.z > 0.99):
-                pass
-            elif (axis.x < -0.99 or axis.y < -0.99 or axis.z < -0.99): # reverse angle if axis -1
-                angle = 2 * math.pi - angle
-            else:
+            angle = transf_angle(rot, fp.BaseRotation, support_rot, fp.Reversed)
+            if angle is None:
                 App.Console.PrintWarning("Multiple axis rotation, breaking!\n")
                 if auto_set_base_pl:
                     if (fp.SupportObject):
@@ -82,10 +389,14 @@ class MotorObserver:
                         fp.BaseRotation = rot
                     App.Console.PrintMessage("Base rotation adjusted automatically\n")
                 return
+            self.track_angle(fp, math.degrees(angle))
             fp.TransfAngle = str (angle) + 'rad'
-            state = [bool(enbl), float(fp.TransfAngle.Value)]
-            if (self.last_state == state):
-                App.Console.PrintMessage("State not changed, pass\n")
+            if not self.state_changed(fp):
+                log_debug("State not changed, pass\n")
+                try:
+                    send_scheduler.suppressed += 1
+                except NameError:
+                    pass
             else:
                 try:
                     trigger_sender()
@@ -107,8 +418,74 @@ class MotorObserver:
 # * The code below can be pasted later.                                     *
 # ***************************************************************************
 
+# registry of MotorObserver objects, built once per document and kept current by a document observer
+# it replaces scanning the whole document with findObjects(Label="MotorObserver") on every send
+class ObserverRegistry:
+    def __init__(self):
+        self.docs = {} # document name -> list of observers, in document order
+
+    def is_observer(self, obj):
+        return "MotorObserver" in obj.Label # same match as findObjects(Label="MotorObserver")
+
+    def observers(self, doc = None):
+        if doc is None:
+            doc = App.ActiveDocument
+        if doc is None:
+            return []
+        observers = self.docs.get(doc.Name)
+        if observers is None:
+            observers = [obj for obj in doc.Objects if self.is_observer(obj)]
+            self.docs[doc.Name] = observers
+        return observers
+
+    def invalidate(self, doc):
+        self.docs.pop(doc.Name, None)
+
+    def slotCreatedObject(self, obj):
+        observers = self.docs.get(obj.Document.Name)
+        if observers is not None and self.is_observer(obj):
+            observers.append(obj) # new objects are appended at the end of the document
+            App.Console.PrintLog("ObserverRegistry: added " + str(obj.Label) + "\n")
+
+    def slotDeletedObject(self, obj):
+        observers = self.docs.get(obj.Document.Name)
+        if observers is None:
+            return
+        for iden, obs in enumerate(observers):
+            if obs.Name == obj.Name:
+                del observers[iden]
+                App.Console.PrintLog("ObserverRegistry: removed " + str(obj.Label) + "\n")
+                break
+
+    def slotChangedObject(self, obj, prop):
+        if prop != "Label":
+            return
+        observers = self.docs.get(obj.Document.Name)
+        if observers is None:
+            return
+        registered = any(obs.Name == obj.Name for obs in observers)
+        if registered != self.is_observer(obj): # relabel changed membership, rebuild to keep document order
+            self.invalidate(obj.Document)
+
+    # labels are not known yet while objects are restored, so the list is built after loading
+    def slotStartRestoreDocument(self, doc):
+        self.invalidate(doc)
+
+    def slotFinishRestoreDocument(self, doc):
+        self.invalidate(doc)
+
+    def slotDeletedDocument(self, doc):
+        self.invalidate(doc)
+
+try:
+    App.removeDocumentObserver(observer_registry) # the script was pasted again, drop the old hook
+except NameError:
+    pass
+observer_registry = ObserverRegistry()
+App.addDocumentObserver(observer_registry)
+
 def create_observer():
-    obs_count = len(App.ActiveDocument.findObjects(Label="MotorObserver"))
+    obs_count = len(observer_registry.observers())
     obs=App.ActiveDocument.addObject("Part::FeaturePython","MotorObserver" +str(obs_count))
     MotorObserver(obs)
     obs.ViewObject.Proxy=0 # just set it to something different from None (this assignment is needed to run an internal notification)
@@ -118,7 +495,7 @@ def create_observer():
 # set_base_pl should be used for setting initial rotations of observers
 # this is required after creation of an observer, or support object change
 def set_base_pl(): # set base placement, used to calculate diff angle
-    observers = App.ActiveDocument.findObjects(Label="MotorObserver")
+    observers = observer_registry.observers()
     for obs in observers:
         if (obs.SupportObject):
             obs.BaseRotation = obs.SupportObject.Placement.Rotation.inverted() * obs.Placement.Rotation
@@ -126,67 +503,1187 @@ def set_base_pl(): # set base placement, used to calculate diff angle
             obs.BaseRotation = obs.Placement.Rotation
         obs.recompute()
 
-timer_sender = QtCore.QTimer()
-timer_sender.setSingleShot(True)
-timer_sender.setInterval(50)
+# batch mode: after a solve, compute TransfAngle of all observers in one vectorized pass
+# instead of one Rotation calculation per onChanged call
+def update_angles_batch(observers):
+    count = len(observers)
+    if count == 0:
+        return
+    rots = np.empty((count, 4))
+    base_rots = np.empty((count, 4))
+    support_rots = np.tile((0.0, 0.0, 0.0, 1.0), (count, 1))
+    revers = np.empty(count, dtype = bool)
+    for iden, obs in enumerate(observers):
+        rots[iden] = obs.Placement.Rotation.Q
+        base_rots[iden] = obs.BaseRotation.Q
+        if (obs.SupportObject):
+            support_rots[iden] = obs.SupportObject.Placement.Rotation.Q
+        revers[iden] = obs.Reversed
+    angles, valid = transf_angles(rots, base_rots, support_rots, revers)
+    for obs, angle, ok in zip(observers, angles.tolist(), valid.tolist()):
+        if ok:
+            if getattr(obs.Proxy, "batch_angle", None) == angle: # already tracked, eg. after the solve and again before sending
+                continue
+            obs.Proxy.batch_angle = angle
+            obs.Proxy.track_angle(obs, math.degrees(angle))
+            obs.TransfAngle = str (angle) + 'rad'
+        else:
+            App.Console.PrintWarning(str(obs.Label) + " Multiple axis rotation, breaking!\n")
+
+# in batch mode revolutions are tracked once after every solve, not only when sending,
+# the zero delay timer fires when the solve has moved all observers and the event loop is running again
+batch_track_timer = QtCore.QTimer()
+batch_track_timer.setSingleShot(True)
+batch_track_timer.timeout.connect(lambda: update_angles_batch(observer_registry.observers()))
+
+def schedule_batch_tracking():
+    if not batch_track_timer.isActive():
+        batch_track_timer.start(0)
+
+def set_batch_angles(enabled):
+    global batch_angles_enabled
+    batch_angles_enabled = enabled
+    App.Console.PrintMessage("Batch angle calculation: " + str(batch_angles_enabled) + "\n")
+
+# compare per-object and batch angle calculation, eg.: benchmark_angles((3, 30, 300), 100)
+def benchmark_angles(counts = (3, 30, 300), repeats = 100):
+    axes = (App.Vector(1, 0, 0), App.Vector(0, 1, 0), App.Vector(0, 0, 1), App.Vector(0, 0, -1))
+    for count in counts:
+        samples = []
+        for iden in range(count):
+            support_rot = App.Rotation(App.Vector(random.random(), random.random(), random.random()), random.uniform(0, 360))
+            base_rot = App.Rotation(App.Vector(random.random(), random.random(), random.random()), random.uniform(0, 360))
+            turn = App.Rotation(random.choice(axes), random.uniform(0, 360))
+            if iden % 10 == 9:
+                turn = App.Rotation(App.Vector(1, 1, 0), 45) # multiple axis rotation
+            samples.append((support_rot * base_rot * turn, base_rot, support_rot, random.random() < 0.5))
+        start = time.perf_counter()
+        for rep in range(repeats):
+            single = [transf_angle(rot, base_rot, support_rot, revers) for rot, base_rot, support_rot, revers in samples]
+        single_time = (time.perf_counter() - start) / repeats
+        start = time.perf_counter()
+        for rep in range(repeats):
+            rots = np.array([smp[0].Q for smp in samples])
+            base_rots = np.array([smp[1].Q for smp in samples])
+            support_rots = np.array([smp[2].Q for smp in samples])
+            revers = np.array([smp[3] for smp in samples])
+            angles, valid = transf_angles(rots, base_rots, support_rots, revers)
+        batch_time = (time.perf_counter() - start) / repeats
+        matching = all((ang is None) == (not ok) for ang, ok in zip(single, valid))
+        max_diff = max([abs(ang - batch_ang) for ang, batch_ang in zip(single, angles) if ang is not None] or [0.0])
+        App.Console.PrintMessage(str(count) + " observers: per-object " + str(round(single_time * 1e6, 1)) + " us, batch "
+                                 + str(round(batch_time * 1e6, 1)) + " us, speedup " + str(round(single_time / batch_time, 2))
+                                 + ", max angle difference " + str(max_diff) + " rad, warnings matching: " + str(matching) + "\n")
+
+# histogram of durations with 8 logarithmic buckets per octave, from 1 us to about 2 minutes
+# recording is O(1), percentiles are accurate to about 9%
+class LatencyHistogram:
+    edges = [1e-6 * 2 ** (iden / 8) for iden in range(27 * 8 + 1)]
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.edges) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, pct): # upper edge of the bucket holding the percentile
+        if not self.count:
+            return 0.0
+        needed = self.count * pct / 100.0
+        cumulative = 0
+        for iden, count in enumerate(self.counts):
+            cumulative += count
+            if count and cumulative >= needed:
+                return min(self.edges[iden] if iden < len(self.edges) else self.max, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return self.name + ": no samples"
+        return (self.name + ": " + str(self.count) + " samples, mean " + str(round(self.total / self.count * 1000, 3)) + " ms, p50 "
+                + str(round(self.percentile(50) * 1000, 3)) + " ms, p90 " + str(round(self.percentile(90) * 1000, 3)) + " ms, p99 "
+                + str(round(self.percentile(99) * 1000, 3)) + " ms, max " + str(round(self.max * 1000, 3)) + " ms")
+
+    def rows(self): # non-empty buckets: name, low (s), high (s), count, cumulative fraction
+        cumulative = 0
+        for iden, count in enumerate(self.counts):
+            if count:
+                cumulative += count
+                low = self.edges[iden - 1] if iden else 0.0
+                high = self.edges[iden] if iden < len(self.edges) else self.max
+                yield [self.name, low, high, count, cumulative / self.count]
+
+# durations measured in the send path, see mo_stats()
+class MotorStats:
+    def __init__(self):
+        self.histograms = {}
+        self.start = time.monotonic()
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram(name)
+        return self.histograms[name]
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+        self.start = time.monotonic()
+
+    def export_csv(self, path):
+        with open(path, "w", newline = "") as f:
+            writer = csv.writer(f)
+            writer.writerow(["metric", "bucket_low_s", "bucket_high_s", "count", "cumulative_fraction"])
+            for histogram in self.histograms.values():
+                writer.writerows(histogram.rows())
+
+motor_stats = MotorStats()
+
+# sends requested by observers are coalesced, at most one send per min_interval (ms)
+# if nothing was sent for max_interval (ms), the last states are sent again as a keep-alive
+class SendScheduler:
+    def __init__(self, min_interval = 50, max_interval = 1000):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.send)
+        self.keep_alive_timer = QtCore.QTimer()
+        self.keep_alive_timer.setSingleShot(True) # restarted after every send, so the gap never exceeds max_interval
+        self.keep_alive_timer.timeout.connect(self.keep_alive)
+        self.last_send = 0.0
+        self.first_request = 0.0
+        self.reset_counters()
+        self.set_rate(min_interval, max_interval)
+
+    def reset_counters(self):
+        self.requests = 0 # changes reported by observers
+        self.suppressed = 0 # changes within the deadband
+        self.coalesced = 0 # requests merged into an already scheduled send
+        self.unchanged = 0 # scheduled sends dropped, no observer moved more than its deadband
+        self.sends = 0
+        self.keep_alives = 0
+
+    def set_rate(self, min_interval, max_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.schedule_keep_alive()
+
+    # the keep-alive is due max_interval after the last send
+    def schedule_keep_alive(self):
+        if not self.max_interval:
+            self.keep_alive_timer.stop()
+            return
+        elapsed = time.monotonic() - self.last_send if self.last_send else 0.0
+        self.keep_alive_timer.start(max(0, int(self.max_interval - elapsed * 1000)))
+
+    # the timer also gives all observers some time to update attributes, before reading them
+    def request(self):
+        self.requests += 1
+        if self.timer.isActive():
+            self.coalesced += 1
+            return
+        self.first_request = time.perf_counter() # latency from the first change to the send
+        delay = self.last_send + self.min_interval / 1000 - time.monotonic()
+        self.timer.start(max(0, int(delay * 1000)))
+
+    def cancel(self):
+        self.timer.stop()
+        self.schedule_keep_alive() # the cancelled send would have restarted it
+
+    def send(self):
+        start = time.perf_counter()
+        sent = send_states(changed = self.first_request) # change_to_send is recorded when the datagram is sent
+        end = time.perf_counter()
+        motor_stats.record("send_states", end - start)
+        if sent:
+            if self.last_send:
+                motor_stats.record("send_interval", time.monotonic() - self.last_send)
+            self.sends += 1
+            self.last_send = time.monotonic()
+        else:
+            self.unchanged += 1
+        self.schedule_keep_alive()
+
+    def keep_alive(self):
+        if self.timer.isActive(): # a send is scheduled, it restarts the keep-alive
+            return
+        if self.last_send:
+            send_states(keep_alive = True)
+            self.keep_alives += 1
+            self.last_send = time.monotonic()
+        self.schedule_keep_alive()
+
+    def report(self):
+        changes = self.requests + self.suppressed
+        packets = self.sends + self.keep_alives
+        App.Console.PrintMessage("Observer changes: " + str(changes) + ", sends: " + str(self.sends) + ", keep-alives: " + str(self.keep_alives)
+                                 + ", coalesced: " + str(self.coalesced) + ", suppressed: " + str(self.suppressed) + ", unchanged: " + str(self.unchanged)
+                                 + ", packet reduction: " + str(round(100.0 * (1 - packets / changes), 1) if changes else 0.0) + "%\n")
 
-timer_finished = True
 sock = None
 
-def send_states():
-    observers = App.ActiveDocument.findObjects(Label="MotorObserver")
+# split observers into groups of up to 3 motors, one group per receiver, in registry order
+def motor_groups(observers):
+    groups = {}
+    for obs in observers:
+        target = (obs.ReceiverAddress, obs.ReceiverPort)
+        groups.setdefault(target, []).append(obs)
+    return list(groups.items())
+
+# states of all observers in 3 motor groups and the receiver of each group
+# protocol 2 can carry ContinuousAngle instead of TransfAngle and Velocity as a third item of every state
+def collect_states(observers):
+    if batch_angles_enabled:
+        update_angles_batch(observers)
+    continuous = wire_protocol == 2 and wire_continuous
+    velocity = wire_protocol == 2 and wire_velocity
+    padding = [False, 0.0, 0.0] if velocity else [False, 0.0]
     states_for_send = []
-    for iden, obs in enumerate(observers):
-        state = [bool(obs.Enabled), float(obs.TransfAngle.Value)]
-        obs.Proxy.last_state = state
-        if len(states_for_send) < 3:
-            states_for_send.append(state)
-        else:
-            App.Console.PrintError(str(obs.Label) + "not added, max 3 motors per group allowed!\n")
-        App.Console.PrintMessage(str(obs.Label) + " " + str(state) + "\n")
-    while len(states_for_send) < 3:
-        iden = len(states_for_send)
-        states_for_send.append([False, 0.0])
-        App.Console.PrintMessage("Dummy" + str(iden) + "motor added for padding\n")
-    if recording_enabled:
-        recorded_states.append(states_for_send)
+    targets = []
+    for target, group in motor_groups(observers):
+        for iden, obs in enumerate(group):
+            state = [bool(obs.Enabled), float(obs.ContinuousAngle.Value if continuous else obs.TransfAngle.Value)]
+            if velocity:
+                state.append(obs.Proxy.current_velocity(obs))
+            if iden < 3:
+                states_for_send.append(state)
+            else:
+                App.Console.PrintError(str(obs.Label) + "not added, max 3 motors per group allowed!\n")
+            log_debug(str(obs.Label) + " " + str(state) + "\n")
+        while len(states_for_send) % 3:
+            iden = len(states_for_send)
+            states_for_send.append(list(padding))
+            log_debug("Dummy" + str(iden) + "motor added for padding\n")
+        targets.append(target)
+    if not targets: # no observers, keep the receiver fed with a disabled group
+        states_for_send = [list(padding) for iden in range(3)]
+        targets = [("", 7755)]
+    return states_for_send, targets
+
+# microsteps per degree of every motor in collect_states() order, from StepsPerRev and UstepsPerStep of the observers
+# steps_per_rev replaces StepsPerRev of all motors, padding motors get the udp_receiver defaults
+def motor_usteps_per_deg(observers, motor_count, steps_per_rev = None):
+    default = (steps_per_rev or 400) / 360.0 * 64.0 # ustepsPerDeg of udp_receiver
+    values = []
+    for target, group in motor_groups(observers):
+        for obs in group[:3]:
+            values.append((steps_per_rev or obs.StepsPerRev) / 360.0 * obs.UstepsPerStep)
+        while len(values) % 3:
+            values.append(default)
+    values = values[:motor_count] + [default] * (motor_count - len(values))
+    return np.array(values)
+
+# returns False if no observer changed more than its deadband since the last send
+# changed - perf_counter() time of the first change, for the change_to_send statistics
+def send_states(keep_alive = False, changed = None):
+    observers = observer_registry.observers()
+    states_for_send, targets = collect_states(observers)
+    if not keep_alive:
+        if not any(obs.Proxy.state_changed(obs) for obs in observers):
+            return False
+        for obs in observers:
+            obs.Proxy.last_state = [bool(obs.Enabled), float(obs.TransfAngle.Value)]
+        if recording_enabled:
+            recorded_states.append(states_for_send)
+            recorded_states.targets = targets
     if immediate_send_enabled:
-        send_states_udp(states_for_send)
-    global timer_finished
-    timer_finished = True
+        send_states_udp(states_for_send, targets, changed = changed)
+    return True
+
+# wire protocol 1 is the bare struct State of udp_receiver: 3 motors per datagram, one setpoint, no header
+# protocol 2 starts with a header, so a receiver can detect lost or reordered datagrams and tell senders apart,
+# and carries any number of motors and one or more timed setpoints, so a short trajectory chunk fits in one datagram
+# every setpoint: time offset from the header timestamp (s), enable bits, float32 angles (deg)
+# a datagram without setpoints tells the receiver to drop its buffered setpoints
+# flags: wire_flag_continuous - angles are multi-turn (ContinuousAngle), no revolution unwrapping needed,
+# wire_flag_velocity - every setpoint also carries float32 velocities (deg/s) after the angles
+wire_magic = b"MO"
+wire_version = 2
+wire_header_format = "<2sBBIIdBBxx" # magic, version, flags, sender id, sequence, timestamp (s), motor count, setpoint count
+wire_header_size = struct.calcsize(wire_header_format)
+wire_max_motors = 32 # enable bits of a setpoint
+wire_max_size = 1472 # no IP fragmentation on ethernet
+wire_protocol = 1 # 1 - legacy, 2 - versioned, set with set_wire_protocol()
+wire_chunk = 1 # protocol 2 replay: setpoints per datagram
+wire_flag_continuous = 1
+wire_flag_velocity = 2
+wire_continuous = False # protocol 2: send ContinuousAngle
+wire_velocity = False # protocol 2: send Velocity
+wire_sender_id = random.getrandbits(32)
+wire_sequences = {} # next sequence number for every receiver
+
+def setpoint_format(motor_count, flags = 0):
+    return "<fI" + "f" * (motor_count * 2 if flags & wire_flag_velocity else motor_count)
+
+# setpoints is a list of (offset, states), states as [[enabled, angle], ...] or [[enabled, angle, velocity], ...] with wire_flag_velocity
+# every setpoint with motor_count states
+def encode_v2(setpoints, sequence, timestamp = None, motor_count = 3, sender_id = None, flags = 0):
+    if not 0 < motor_count <= wire_max_motors:
+        raise ValueError("motor count must be 1 to " + str(wire_max_motors))
+    if len(setpoints) > 255:
+        raise ValueError("at most 255 setpoints per datagram")
+    values = []
+    for offset, states in setpoints:
+        if len(states) != motor_count:
+            raise ValueError("setpoint with " + str(len(states)) + " states, expected " + str(motor_count))
+        values.append(offset)
+        values.append(sum(1 << iden for iden, state in enumerate(states) if state[0]))
+        values.extend(state[1] for state in states)
+        if flags & wire_flag_velocity:
+            values.extend(state[2] for state in states)
+    header = struct.pack(wire_header_format, wire_magic, wire_version, flags, wire_sender_id if sender_id is None else sender_id,
+                         sequence & 0xFFFFFFFF, time.time() if timestamp is None else timestamp, motor_count, len(setpoints))
+    return header + struct.pack("<" + setpoint_format(motor_count, flags)[1:] * len(setpoints), *values)
+
+# returns None for legacy datagrams, raises ValueError for damaged ones
+def decode_v2(data):
+    if len(data) < wire_header_size or data[:2] != wire_magic:
+        return None
+    magic, version, flags, sender_id, sequence, timestamp, motor_count, count = struct.unpack_from(wire_header_format, data)
+    if version != wire_version:
+        raise ValueError("unsupported protocol version " + str(version))
+    size = struct.calcsize(setpoint_format(motor_count, flags))
+    if len(data) != wire_header_size + size * count:
+        raise ValueError("datagram size " + str(len(data)) + " does not match " + str(count) + " setpoints of " + str(motor_count) + " motors")
+    setpoints = []
+    for iden in range(count):
+        values = struct.unpack_from(setpoint_format(motor_count, flags), data, wire_header_size + iden * size)
+        states = [[bool(values[1] >> motor & 1), values[2 + motor]] for motor in range(motor_count)]
+        if flags & wire_flag_velocity:
+            for motor, state in enumerate(states):
+                state.append(values[2 + motor_count + motor])
+        setpoints.append((values[0], states))
+    return {"version": version, "flags": flags, "sender_id": sender_id, "sequence": sequence, "timestamp": timestamp,
+            "motor_count": motor_count, "setpoints": setpoints}
+
+# setpoints that fit in one datagram
+def wire_chunk_limit(motor_count = 3, flags = 0):
+    return min(255, (wire_max_size - wire_header_size) // struct.calcsize(setpoint_format(motor_count, flags)))
+
+# states_for_send holds 3 states per group, targets holds (address, port) of each group, empty address means adr
+# with the network thread running the states are only handed over to it, exact - every state is sent (replay), not only the newest
+# False if the network thread queue stayed full for timeout (s), see NetworkSender.publish()
+def send_states_udp(states_for_send, targets = None, exact = False, changed = None, timeout = None):
+    if wire_protocol == 2:
+        return send_setpoints_udp([(0.0, states_for_send)], targets, exact = exact, changed = changed, timeout = timeout)
+    elif network_sender and network_sender.running():
+        return network_sender.publish(transmit_states_udp, (states_for_send, targets), exact, changed, timeout)
+    else:
+        transmit_states_udp(states_for_send, targets)
+        record_change_to_send(changed)
+        return True
+
+# protocol 2, setpoints as (offset, states_for_send), every group gets its own datagram with its own sequence
+# groups = number of groups when there are no setpoints
+def send_setpoints_udp(setpoints, targets = None, groups = 1, exact = False, changed = None, timeout = None):
+    timestamp = time.time() # offsets are counted from now, not from the moment the network thread sends
+    if network_sender and network_sender.running():
+        return network_sender.publish(transmit_setpoints_udp, (setpoints, targets, groups, timestamp), exact, changed, timeout)
+    else:
+        transmit_setpoints_udp(setpoints, targets, groups, timestamp)
+        record_change_to_send(changed)
+        return True
+
+# latency from the first observer change to the UDP send
+def record_change_to_send(changed):
+    if changed is not None:
+        motor_stats.record("change_to_send", time.perf_counter() - changed)
+
+resolved_adr = None
+resolved_targets = {} # (host, port): address for sendto, host names are resolved once
+
+# host names are resolved again when adr changes or a send fails
+def resolve_target(address, port):
+    global resolved_adr
+    if adr != resolved_adr:
+        resolved_targets.clear()
+        resolved_adr = adr
+    key = (address or adr, port)
+    target = resolved_targets.get(key)
+    if target is None:
+        target = socket.getaddrinfo(key[0], port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+        resolved_targets[key] = target
+    return target
+
+target_errors = {} # (host, port): failed sends, reported by send_stats()
+target_error_times = {} # (host, port): time of the last printed error
+
+# every receiver is sent to on its own, a failing one does not stop sending to the others
+def send_to_target(data, address, port):
+    key = (address or adr, port)
+    try:
+        sock.sendto(data, resolve_target(address, port))
+        return True
+    except OSError as e:
+        resolved_targets.pop(key, None) # resolved again on the next send
+        target_errors[key] = target_errors.get(key, 0) + 1
+        now = time.monotonic()
+        if now - target_error_times.get(key, 0.0) > 1.0: # do not flood the report view
+            App.Console.PrintError("Sending to " + str(key[0]) + ":" + str(port) + " failed: " + str(e) + "\n")
+            target_error_times[key] = now
+        return False
+
+def report_target_errors():
+    for (address, port), errors in sorted(target_errors.items()):
+        App.Console.PrintMessage("Failed sends to " + str(address) + ":" + str(port) + ": " + str(errors) + "\n")
 
-def send_states_udp(states_for_send):
+def transmit_states_udp(states_for_send, targets = None):
+    if wire_protocol == 2:
+        transmit_setpoints_udp([(0.0, states_for_send)], targets)
+        return
     format_string = "?f" * len(states_for_send)
-    packed_states = struct.pack(format_string, *(item for sublist in states_for_send for item in sublist))
+    packed_states = struct.pack(format_string, *(item for sublist in states_for_send for item in sublist)) # all groups packed at once
     if (sock and not sock._closed):
-        App.Console.PrintMessage("States changed, sending MotorObservers\n")
-        sent = sock.sendto(packed_states, (adr, 7755))
+        log_debug("States changed, sending MotorObservers\n")
+        packet_size = struct.calcsize("?f?f?f")
+        packets = memoryview(packed_states)
+        for iden in range(len(packed_states) // packet_size):
+            address, port = targets[iden] if targets and iden < len(targets) else ("", 7755)
+            send_to_target(packets[iden * packet_size:(iden + 1) * packet_size], address, port)
 
-timer_sender.timeout.connect(send_states)
+def transmit_setpoints_udp(setpoints, targets = None, groups = 1, timestamp = None):
+    if setpoints:
+        groups = len(setpoints[0][1]) // 3
+    timestamp = time.time() if timestamp is None else timestamp
+    for iden in range(groups):
+        address, port = targets[iden] if targets and iden < len(targets) else ("", 7755)
+        target = (address or adr, port)
+        sequence = wire_sequences.get(target, 0)
+        wire_sequences[target] = sequence + 1
+        flags = wire_flag_continuous if wire_continuous else 0
+        if setpoints and len(setpoints[0][1][0]) > 2:
+            flags |= wire_flag_velocity
+        data = encode_v2([(offset, states[iden * 3:iden * 3 + 3]) for offset, states in setpoints], sequence, timestamp, flags = flags)
+        if (sock and not sock._closed):
+            log_debug("Sending " + str(len(setpoints)) + " setpoints, sequence " + str(sequence) + "\n")
+            send_to_target(data, address, port)
+
+# sends datagrams on its own thread, so name resolution, a slow network or a closed socket do not block the GUI
+# live states go to a latest-value slot, a newer state replaces one not sent yet
+# exact publishing (replay) goes to a bounded queue, the publishing thread waits when the queue is full
+# min_interval (s) paces slot sends, states arriving in between are merged into the newest one
+class NetworkSender:
+    def __init__(self, min_interval = 0.0, queue_size = 1000):
+        self.min_interval = min_interval
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.latest = None # (function, args, changed) of the newest live send
+        self.queue = []
+        self.stopped = False
+        self.last_send = 0.0
+        self.last_error = 0.0
+        self.reset_counters()
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def reset_counters(self):
+        self.published = 0
+        self.replaced = 0 # live states replaced by newer ones before sending
+        self.sent = 0
+        self.errors = 0
+
+    def running(self):
+        return not self.stopped and self.thread.is_alive()
+
+    # changed - time of the observer change, the change_to_send latency is recorded after sending
+    # timeout (s) - exact publishing waits at most this long for room in the queue, False is returned when there is none
+    def publish(self, function, args, exact = False, changed = None, timeout = None):
+        with self.condition:
+            if exact:
+                deadline = None if timeout is None else time.perf_counter() + timeout
+                while len(self.queue) >= self.queue_size and not self.stopped:
+                    remaining = None if deadline is None else deadline - time.perf_counter()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self.condition.wait(remaining)
+                self.queue.append((function, args, changed))
+            else:
+                if self.latest is not None:
+                    self.replaced += 1
+                self.latest = (function, args, changed)
+            self.published += 1
+            self.condition.notify_all()
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and self.latest is None and not self.queue:
+                    self.condition.wait()
+                if self.queue:
+                    function, args, changed = self.queue.pop(0)
+                    self.condition.notify_all() # room for a waiting publisher
+                elif self.latest is not None:
+                    delay = self.last_send + self.min_interval - time.perf_counter()
+                    if delay > 0 and not self.stopped:
+                        self.condition.wait(delay) # a newer state may replace this one
+                        continue
+                    function, args, changed = self.latest
+                    self.latest = None
+                else: # stopped and nothing left to send
+                    break
+            start = time.perf_counter()
+            try:
+                function(*args)
+                self.sent += 1
+                record_change_to_send(changed)
+            except (OSError, ValueError) as e:
+                self.errors += 1
+                if start - self.last_error > 1.0: # do not flood the report view
+                    App.Console.PrintError("Sending failed: " + str(e) + "\n")
+                    self.last_error = start
+            self.last_send = time.perf_counter()
+            motor_stats.record("network_send", self.last_send - start)
+
+    # queued states are still sent, unless flush is False
+    def stop(self, flush = True):
+        with self.condition:
+            if not flush:
+                self.queue = []
+                self.latest = None
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join(1.0)
+
+    def report(self):
+        App.Console.PrintMessage("Network thread: " + ("running" if self.running() else "stopped") + ", published: " + str(self.published)
+                                 + ", replaced: " + str(self.replaced) + ", sent: " + str(self.sent) + ", errors: " + str(self.errors)
+                                 + ", queued: " + str(len(self.queue)) + "\n")
+
+try:
+    network_sender.stop() # the script was pasted again, stop the old thread
+except NameError:
+    pass
+network_sender = NetworkSender()
+
+# enabled False sends directly from the calling thread, like before
+def set_network_thread(enabled = True, min_interval = 0.0, queue_size = 1000):
+    global network_sender
+    if network_sender:
+        network_sender.stop()
+    network_sender = NetworkSender(min_interval, queue_size) if enabled else None
+
+# version 1 - legacy 24 byte datagrams understood by udp_receiver, version 2 - versioned datagrams with a header
+# chunk - protocol 2 replay sends this many future setpoints in every datagram, so fewer datagrams are needed
+# continuous - protocol 2 sends multi-turn ContinuousAngle, velocity - protocol 2 also sends filtered Velocity of observers
+def set_wire_protocol(version = 1, chunk = 1, continuous = False, velocity = False):
+    global wire_protocol, wire_chunk, wire_continuous, wire_velocity
+    if version not in (1, 2):
+        App.Console.PrintError("Unknown wire protocol: " + str(version) + "\n")
+        return
+    if version == 1 and (continuous or velocity):
+        App.Console.PrintWarning("Continuous angles and velocities need protocol 2\n")
+    wire_protocol = version
+    wire_continuous = continuous
+    wire_velocity = velocity
+    wire_chunk = max(1, min(int(chunk), wire_chunk_limit()))
+    if wire_chunk != chunk:
+        App.Console.PrintWarning("Chunk limited to " + str(wire_chunk) + " setpoints per datagram\n")
+
+try:
+    send_scheduler.cancel() # the script was pasted again, stop the old timers
+    send_scheduler.set_rate(send_scheduler.min_interval, 0)
+except NameError:
+    pass
+send_scheduler = SendScheduler()
 
-# the timer gives all observers some time to update attributes, before reading them
 def trigger_sender():
-    if (timer_finished):
-        timer_sender.start()
+    send_scheduler.request()
+
+# min_interval - shortest time between sends (ms), max_interval - keep-alive interval (ms), 0 disables keep-alive
+def set_send_rate(min_interval = 50, max_interval = 1000):
+    send_scheduler.set_rate(min_interval, max_interval)
+
+def send_stats(reset = False):
+    send_scheduler.report()
+    if network_sender:
+        network_sender.report()
+    report_target_errors()
+    if reset:
+        send_scheduler.reset_counters()
+        target_errors.clear()
+        if network_sender:
+            network_sender.reset_counters()
+
+# send path statistics: latency from observer change to UDP send, sends per second, suppressed changes, VR solve time
+def mo_stats(reset = False, csv_path = None):
+    elapsed = time.monotonic() - motor_stats.start
+    App.Console.PrintMessage("Statistics of the last " + str(round(elapsed, 1)) + " s, sends per second: "
+                             + str(round(send_scheduler.sends / elapsed, 2) if elapsed > 0 else 0.0) + "\n")
+    send_scheduler.report()
+    if network_sender:
+        network_sender.report()
+    report_target_errors()
+    for histogram in motor_stats.histograms.values():
+        App.Console.PrintMessage(histogram.summary() + "\n")
+    if csv_path:
+        motor_stats.export_csv(csv_path)
+        App.Console.PrintMessage("Histograms exported to " + str(csv_path) + "\n")
+    if reset:
+        motor_stats.reset()
+        send_scheduler.reset_counters()
+        target_errors.clear()
+        if network_sender:
+            network_sender.reset_counters()
 
-def record_states(enabled, reset = True, send_and_rec = True):
+def set_log_level(level):
+    global log_level
+    log_level = level
+
+# max_frames > 0 keeps only the newest max_frames states (ring buffer), 0 keeps everything
+def record_states(enabled, reset = True, send_and_rec = True, max_frames = None):
     global recording_enabled, immediate_send_enabled
     recording_enabled = enabled
     immediate_send_enabled = send_and_rec
     if enabled and reset:
         recorded_states.clear()
+    if max_frames is not None:
+        recorded_states.set_max_frames(max_frames)
+    recorded_states.start_time = None # appended states continue from the last recorded timestamp
     App.Console.PrintMessage("Recording states: " + str(recording_enabled) + "Current number: " + str(len(recorded_states)) + "\n")
 
-def replay_states(interval = 100):
-    l = len (recorded_states)
-    for i, sfs in enumerate(recorded_states):
-        send_states_udp(sfs)
-        App.Console.PrintMessage("Sent " + str (i + 1) + "of" + str(l) + "\n")
-        time.sleep(interval / 1000)
+def save_states(path):
+    recorded_states.save(path)
+    App.Console.PrintMessage("Saved " + str(len(recorded_states)) + " states to " + str(path) + "\n")
+
+def load_states(path):
+    global recorded_states
+    try:
+        recorded_states = TrajectoryStore.load(path)
+    except (OSError, ValueError) as e:
+        App.Console.PrintError("Loading states failed: " + str(e) + "\n")
+        return
+    App.Console.PrintMessage("Loaded " + str(len(recorded_states)) + " states from " + str(path) + "\n")
+
+# replays recorded states on its own thread, so the GUI stays responsive
+# every frame has an absolute deadline counted from an anchor, so sleep and send overhead do not accumulate
+class ReplayPlayer:
+    publish_timeout = 0.05 # s, the lock is not held longer while the network thread queue is full, so pause and stop do not wait
+
+    def __init__(self, store, interval = None, speed = 1.0, loop = False):
+        self.store = store
+        self.interval = interval / 1000 if interval else None # None replays with recorded timing
+        self.speed = speed
+        self.loop = loop
+        self.position = 0 # next frame to send
+        self.paused = False
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event() # interrupts waiting on pause, seek, speed change or stop
+        self.stopped = False
+        self.send_times = [] # (frame, deadline, sent, frames in the datagram) for timing statistics
+        self.thread = threading.Thread(target = self.run, daemon = True)
+
+    def frame_time(self, iden): # time of a frame in the recording, in seconds
+        if self.interval is None:
+            return self.store.time(iden)
+        return iden * self.interval
+
+    def loop_gap(self): # pause between the last and first frame when looping
+        if self.interval is None:
+            count = len(self.store)
+            return (self.store.time(count - 1) - self.store.time(0)) / (count - 1) if count > 1 else 0.1
+        return self.interval
+
+    def anchor(self, now = None): # deadlines are counted from the current frame and time
+        self.anchor_time = time.perf_counter() if now is None else now
+        self.anchor_frame = self.position
+
+    def deadline(self, iden):
+        return self.anchor_time + (self.frame_time(iden) - self.frame_time(self.anchor_frame)) / self.speed
+
+    def start(self):
+        self.anchor()
+        self.thread.start()
+
+    def run(self):
+        blocked = False
+        while not self.stopped:
+            if blocked:
+                time.sleep(0.001) # the network thread queue is full, let pause and stop take the lock
+            with self.lock:
+                if self.stopped: # stopped before the wakeup is cleared
+                    break
+                if self.paused:
+                    deadline = None
+                else:
+                    iden = self.position
+                    deadline = self.deadline(iden)
+                self.wakeup.clear()
+            if deadline is None:
+                self.wakeup.wait()
+                continue
+            delay = deadline - time.perf_counter()
+            if delay > 0 and self.wakeup.wait(delay):
+                continue # state changed while waiting, recalculate the deadline
+            with self.lock:
+                if self.stopped or self.paused or iden != self.position:
+                    continue
+                count = min(self.chunk(), len(self.store) - iden)
+                if count > 1: # protocol 2, the receiver buffers the next frames with their offsets
+                    sent = send_setpoints_udp([(self.deadline(frame) - deadline, self.store[frame]) for frame in range(iden, iden + count)], self.store.targets,
+                                              exact = True, timeout = self.publish_timeout)
+                else:
+                    sent = send_states_udp(self.store[iden], self.store.targets, exact = True, timeout = self.publish_timeout)
+                blocked = not sent
+                if blocked:
+                    continue # try again after releasing the lock
+                self.send_times.append((iden, deadline, time.perf_counter(), count))
+                self.position += count
+                if self.position >= len(self.store):
+                    if not self.loop:
+                        break
+                    last = self.deadline(iden + count - 1) # last frame of the chunk, the receiver holds it until then
+                    self.position = 0
+                    self.anchor(last + self.loop_gap() / self.speed) # keep the period across the loop
+        self.stopped = True
+        App.Console.PrintMessage("Replay finished\n")
+
+    def chunk(self):
+        return wire_chunk if wire_protocol == 2 else 1
+
+    # frames of the last chunk, which are not due yet, are dropped by the receiver and sent again after resume
+    def drop_buffered(self):
+        if not self.send_times or self.send_times[-1][3] < 2:
+            return
+        iden, deadline, sent, count = self.send_times[-1]
+        now = time.perf_counter()
+        while iden < self.position and self.deadline(iden) <= now:
+            iden += 1
+        if iden < self.position:
+            self.position = iden
+            send_setpoints_udp([], self.store.targets, len(self.store.targets), exact = True, timeout = self.publish_timeout)
+
+    def pause(self):
+        with self.lock:
+            if not self.paused:
+                self.drop_buffered()
+            self.paused = True
+        self.wakeup.set()
+
+    def resume(self):
+        with self.lock:
+            if self.paused:
+                self.paused = False
+                self.anchor()
+        self.wakeup.set()
+
+    def seek(self, iden):
+        with self.lock:
+            self.position = max(0, min(iden, len(self.store) - 1))
+            self.anchor()
+        self.wakeup.set()
+
+    def set_speed(self, speed):
+        with self.lock:
+            self.anchor(self.deadline(self.position) if not self.paused else None) # next frame keeps its deadline
+            self.speed = speed
+        self.wakeup.set()
+
+    def stop(self):
+        with self.lock:
+            if not self.stopped and not self.paused:
+                self.drop_buffered()
+            self.stopped = True
+        self.wakeup.set()
+
+    def stats(self): # achieved vs requested period and jitter of consecutive frames, in seconds
+        with self.lock:
+            send_times = list(self.send_times)
+        periods = []
+        requested = []
+        for (iden0, deadline0, sent0, count0), (iden1, deadline1, sent1, count1) in zip(send_times, send_times[1:]):
+            if iden1 == iden0 + count0: # skip seeks and loops
+                periods.append(sent1 - sent0)
+                requested.append(deadline1 - deadline0)
+        lateness = [sent - deadline for iden, deadline, sent, count in send_times]
+        if not periods:
+            return None
+        errors = [period - req for period, req in zip(periods, requested)]
+        mean_error = sum(errors) / len(errors)
+        return {"frames": sum(count for iden, deadline, sent, count in send_times),
+                "datagrams": len(send_times),
+                "requested_period": sum(requested) / len(requested),
+                "achieved_period": sum(periods) / len(periods),
+                "jitter": (sum((err - mean_error) ** 2 for err in errors) / len(errors)) ** 0.5,
+                "max_lateness": max(lateness),
+                "drift": send_times[-1][2] - send_times[-1][1] - lateness[0]}
+
+replay_player = None
+
+# replay runs in the background, use replay_pause(), replay_resume(), replay_seek(), replay_speed() and replay_stop() to control it
+# without interval states are sent with the recorded timing
+def replay_states(interval = None, speed = 1.0, loop = False):
+    global replay_player
+    if replay_player and not replay_player.stopped:
+        replay_player.stop()
+    if len(recorded_states) == 0:
+        App.Console.PrintMessage("No recorded states to replay\n")
+        return
+    replay_player = ReplayPlayer(recorded_states, interval, speed, loop)
+    replay_player.start()
+    App.Console.PrintMessage("Replaying " + str(len(recorded_states)) + " states\n")
+
+# drop recorded states that motors cannot distinguish, tolerance in microsteps
+# microsteps come from StepsPerRev and UstepsPerStep of the observers, steps_per_rev replaces StepsPerRev, eg. to match -steps_per_rev of udp_receiver
+# max_gap (s) - longest time between kept states, replay lags behind the recording by up to the longest gap
+def decimate_states(tolerance = 1.0, steps_per_rev = None, max_gap = 0.25):
+    global recorded_states
+    count = len(recorded_states)
+    if count < 3:
+        App.Console.PrintMessage("Not enough recorded states to decimate\n")
+        return
+    usteps_per_deg = motor_usteps_per_deg(observer_registry.observers(), recorded_states.motor_count, steps_per_rev)
+    frames = recorded_states.frames()
+    times = frames["time"]
+    angles = unwrap_angles(frames["angles"].astype(float))
+    enabled = frames["enabled"]
+    keep = decimate_mask(times, angles * usteps_per_deg, tolerance, 180.0 * usteps_per_deg, max_gap)
+    changed = np.flatnonzero(enabled[1:] != enabled[:-1]) # keep frames around enable switching
+    keep[changed] = True
+    keep[changed + 1] = True
+    kept_times = times[keep]
+    received = unwrap_angles(frames["angles"][keep].astype(float)) # replay sends wrapped angles, udp_receiver unwraps them again
+    errors = np.array([np.abs(np.interp(times, kept_times, received[:, motor]) - angles[:, motor]).max() for motor in range(angles.shape[1])])
+    max_error = float(errors.max()) if len(errors) else 0.0
+    max_usteps = float((errors * usteps_per_deg).max()) if len(errors) else 0.0
+    longest_gap = float(np.diff(kept_times).max())
+    recorded_states = recorded_states.subset(keep)
+    App.Console.PrintMessage("Decimated states: " + str(count) + " -> " + str(len(recorded_states)) + " ("
+                             + str(round(100.0 * (1 - len(recorded_states) / count), 1)) + "% fewer packets), max angle error: "
+                             + str(round(max_error, 4)) + " deg (" + str(round(max_usteps, 2)) + " usteps), longest gap (replay lag): "
+                             + str(round(longest_gap * 1000, 1)) + " ms\n")
+
+def replay_pause():
+    if replay_player:
+        replay_player.pause()
+
+def replay_resume():
+    if replay_player:
+        replay_player.resume()
+
+def replay_seek(iden):
+    if replay_player:
+        replay_player.seek(iden)
+
+def replay_speed(speed):
+    if replay_player:
+        replay_player.set_speed(speed)
+
+def replay_stop():
+    if replay_player:
+        replay_player.stop()
+
+def replay_stats():
+    stats = replay_player.stats() if replay_player else None
+    if not stats:
+        App.Console.PrintMessage("No replay timing collected\n")
+        return
+    App.Console.PrintMessage("Replayed frames: " + str(stats["frames"]) + " in " + str(stats["datagrams"]) + " datagrams, requested period: " + str(round(stats["requested_period"] * 1000, 3))
+                             + " ms, achieved period: " + str(round(stats["achieved_period"] * 1000, 3)) + " ms, jitter: "
+                             + str(round(stats["jitter"] * 1000, 3)) + " ms, max lateness: " + str(round(stats["max_lateness"] * 1000, 3))
+                             + " ms, drift: " + str(round(stats["drift"] * 1000, 3)) + " ms\n")
+    return stats
+
+# offline dry run of udp_receiver for one group of 3 motors, mirrors dataConsumer() and b3D():
+# revolution unwrapping (jumps over 180 deg), float32 ustepsPerDeg conversion, integer microsecond intervals divided by the queue size,
+# min/max deg/s clamping of the microstep interval and the microstep sequence of the 3D Bresenham line
+# Bresenham moves every axis by exactly its distance in max_dist steps with the same interval, so steps, rates and durations
+# are calculated for all packets at once, only the timeline (a packet starts when the previous one is finished) is a loop over packets
+# arrivals (s), angles (n, 3) deg, enabled (n, 3), start - time the receiver was started (s), by default the first arrival
+# the first packet is homing from 0, it is left out of speed clamps and peak rates
+def simulate_receiver(arrivals, angles, enabled, steps_per_rev = 400, max_degs_per_second = 360.0, min_degs_per_second = 10.0, start = None):
+    arrivals = np.asarray(arrivals, dtype = float)
+    angles = np.asarray(angles, dtype = np.float32)
+    enabled = np.asarray(enabled, dtype = bool)
+    count = len(arrivals)
+    usteps_per_deg = np.float32(steps_per_rev) / np.float32(360.0) * np.float32(64.0) # float ustepsPerDeg
+    jumps = np.diff(angles, axis = 0, prepend = np.zeros((1, 3), dtype = np.float32)) # oldAngle starts at 0
+    full_revs = np.cumsum((jumps < -180.0).astype(np.int64) - (jumps > 180.0), axis = 0)
+    total_angles = full_revs.astype(np.float32) * np.float32(360.0) + angles
+    expected = np.trunc(usteps_per_deg * total_angles).astype(np.int64) # int() of the float product
+    moves = np.diff(expected, axis = 0, prepend = np.zeros((1, 3), dtype = np.int64))
+    distances = np.abs(moves)
+    max_dist = distances.max(axis = 1)
+    arrivals_us = np.round(arrivals * 1e6).astype(np.int64)
+    start_us = arrivals_us[0] if start is None else int(round(start * 1e6))
+    intervals = np.diff(arrivals_us, prepend = start_us)
+    no_min_speed = min_degs_per_second <= 0 # -min_degs_per_second 0, the interval saturates on the Pi, no minimum speed clamp
+    max_ustep_interval = np.iinfo(np.int64).max if no_min_speed else int(1e6 / float(np.float32(min_degs_per_second) * usteps_per_deg))
+    min_ustep_interval = int(1e6 / float(np.float32(max_degs_per_second) * usteps_per_deg))
+    starts = np.zeros(count, dtype = np.int64)
+    raw_intervals = np.zeros(count, dtype = np.int64) # ustepInterval before clamping
+    ustep_intervals = np.zeros(count, dtype = np.int64)
+    queued = np.zeros(count, dtype = np.int64)
+    arrival_list = arrivals_us.tolist()
+    busy = start_us
+    for iden, (arrival, interval, dist) in enumerate(zip(arrival_list, intervals.tolist(), max_dist.tolist())):
+        begin = max(arrival, busy)
+        waiting = bisect.bisect_right(arrival_list, begin) - iden - 1 # stateQueue.size() after pop
+        if waiting > 1:
+            interval = int(interval / waiting) # integer division truncating toward zero, like C++
+        raw_interval = int(interval / (dist + 1))
+        ustep_interval = min(max(raw_interval, min_ustep_interval), max_ustep_interval)
+        starts[iden] = begin
+        raw_intervals[iden] = raw_interval
+        ustep_intervals[iden] = ustep_interval
+        queued[iden] = waiting
+        busy = begin + dist * ustep_interval
+    ends = starts + max_dist * ustep_intervals
+    durations = np.maximum(max_dist * ustep_intervals, 1) / 1e6
+    rates = distances / durations[:, None] # usteps/s of every axis during every packet
+    # the first packet moves from the receiver start position 0 and usually has no interval, it is homing, not a part of the motion
+    motion = np.arange(count) > 0
+    moving = motion & (max_dist > 0)
+    peak_rate = rates[motion].max(axis = 0) if count > 1 else np.zeros(3)
+    return {"steps": distances.sum(axis = 0), # microsteps (step pin level changes) of every axis, with homing
+            "homing_steps": distances[0] if count else np.zeros(3, dtype = np.int64),
+            "lost_steps": (distances * ~enabled).sum(axis = 0), # done with the driver disabled
+            "net_steps": expected[-1] if count else np.zeros(3, dtype = np.int64),
+            "peak_step_rate": peak_rate, # usteps/s, mean rate of a packet, without homing
+            "peak_deg_per_s": peak_rate / float(usteps_per_deg),
+            "max_clamps": int(((raw_intervals < min_ustep_interval) & motion).sum()), # "Maximum speed exceeded, correcting"
+            "min_clamps": 0 if no_min_speed else int(((raw_intervals > max_ustep_interval) & motion).sum()), # "Minimum speed exceeded, correcting"
+            "min_clamps_moving": 0 if no_min_speed else int(((raw_intervals > max_ustep_interval) & moving).sum()),
+            "max_queue": int(queued.max()) if count else 0,
+            "starts": (starts - start_us) / 1e6, # achieved timeline, s from the receiver start
+            "ends": (ends - start_us) / 1e6,
+            "lag": (ends - arrivals_us) / 1e6, # from packet arrival to reaching its position
+            "usteps_per_deg": float(usteps_per_deg)}
+
+# dry run of recorded (or loaded, baked) states on simulated receivers, one per 3 motor group, before driving real motors
+# interval (ms) and speed as for replay_states(), the other arguments as the udp_receiver options
+def simulate_states(store = None, interval = None, speed = 1.0, steps_per_rev = 400, max_degs_per_second = 360.0, min_degs_per_second = 10.0):
+    store = store if store is not None else recorded_states
+    if len(store) == 0:
+        App.Console.PrintMessage("No recorded states to simulate\n")
+        return None
+    frames = store.frames()
+    if interval is None:
+        times = (frames["time"] - frames["time"][0]) / speed
+    else:
+        times = np.arange(len(frames)) * interval / 1000.0 / speed
+    bits = frames["enabled"].astype(np.int64)
+    start = time.perf_counter()
+    reports = []
+    for group in range(store.motor_count // 3):
+        motors = np.arange(group * 3, group * 3 + 3)
+        enabled = (bits[:, None] >> motors) & 1 == 1
+        report = simulate_receiver(times, frames["angles"][:, motors], enabled, steps_per_rev, max_degs_per_second, min_degs_per_second)
+        reports.append(report)
+        target = store.targets[group] if group < len(store.targets) else ("", 7755)
+        App.Console.PrintMessage("Receiver " + str(target[0] or adr) + ":" + str(target[1]) + ", usteps: " + str(report["steps"].tolist())
+                                 + " (homing: " + str(report["homing_steps"].tolist()) + "), with disabled driver: " + str(report["lost_steps"].tolist()) + ", peak deg/s: "
+                                 + str(np.round(report["peak_deg_per_s"], 1).tolist()) + "\n")
+        App.Console.PrintMessage("  maximum speed clamps: " + str(report["max_clamps"]) + ", minimum speed clamps while moving: "
+                                 + str(report["min_clamps_moving"]) + ", longest queue: " + str(report["max_queue"]) + ", max lag: "
+                                 + str(round(float(report["lag"].max()) * 1000, 1)) + " ms, finished at " + str(round(float(report["ends"][-1]), 2))
+                                 + " s of " + str(round(float(times[-1]), 2)) + " s\n")
+    App.Console.PrintMessage("Simulated " + str(len(frames)) + " states in " + str(round(time.perf_counter() - start, 3)) + " s\n")
+    return reports
+
+# inverse kinematics lookup table: observer angles solved once on a regular grid of target positions
+# at runtime the angles are interpolated from the target position, without solving the assembly
+# angles are in degrees like TransfAngle, cells with a failed solve are marked invalid
+class IKTable:
+    def __init__(self, origin, step, angles, enabled, valid, targets = None, meta = None):
+        self.origin = np.asarray(origin, dtype = float)
+        self.step = np.asarray(step, dtype = float)
+        self.angles = np.asarray(angles, dtype = np.float32) # (nx, ny, nz, motors)
+        self.enabled = np.asarray(enabled, dtype = bool) # (motors,)
+        self.valid = np.asarray(valid, dtype = bool) # (nx, ny, nz)
+        self.targets = list(targets or []) # receiver of each 3 motor group
+        self.meta = dict(meta or {})
+
+    def __repr__(self):
+        return "IKTable(" + "x".join(str(n) for n in self.valid.shape) + " points, " + str(self.angles.shape[-1]) + " motors)"
+
+    def upper(self):
+        return self.origin + self.step * (np.array(self.valid.shape) - 1)
+
+    def save(self, path):
+        with open(path, "wb") as f: # file object, so numpy does not append .npz
+            np.savez_compressed(f, origin = self.origin, step = self.step, angles = self.angles, enabled = self.enabled, valid = self.valid,
+                                meta = np.array(json.dumps(dict(self.meta, targets = self.targets))))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            targets = [tuple(target) for target in meta.pop("targets", [])]
+            return cls(data["origin"], data["step"], data["angles"], data["enabled"], data["valid"], targets, meta)
+
+    # trilinear interpolation of positions (n, 3), returns angles (n, motors), NaN outside the grid or next to invalid points
+    def interpolate(self, positions):
+        positions = np.atleast_2d(np.asarray(positions, dtype = float))
+        shape = np.array(self.valid.shape)
+        rel = (positions - self.origin) / self.step
+        inside = np.all((rel >= -1e-9) & (rel <= shape - 1 + 1e-9), axis = 1)
+        base = np.clip(np.floor(rel).astype(int), 0, np.maximum(shape - 2, 0))
+        frac = np.clip(rel - base, 0.0, 1.0)
+        ref = None
+        result = np.zeros((len(positions), self.angles.shape[-1]))
+        for corner in range(8):
+            offset = np.array([corner >> 2 & 1, corner >> 1 & 1, corner & 1])
+            idx = np.minimum(base + offset, shape - 1)
+            values = self.angles[idx[:, 0], idx[:, 1], idx[:, 2]].astype(float)
+            inside &= self.valid[idx[:, 0], idx[:, 1], idx[:, 2]]
+            if ref is None:
+                ref = values
+            else: # angles wrap at 360, interpolate the shorter way
+                values = ref + (values - ref + 180.0) % 360.0 - 180.0
+            weight = np.prod(np.where(offset == 1, frac, 1.0 - frac), axis = 1)
+            result += weight[:, None] * values
+        result = result % 360.0
+        result[~inside] = np.nan
+        return result
+
+    # states_for_send for one position, None outside the table
+    def states(self, position):
+        angles = self.interpolate(position)[0]
+        if np.isnan(angles).any():
+            return None
+        return [[bool(enbl), float(angle)] for enbl, angle in zip(self.enabled, angles)]
+
+ik_table = None
+
+# solver result of FreeCAD assemblies: 0 (or None in older versions) means success
+# solves every assembly of the document, False if any solve failed
+def solve_assemblies(doc):
+    success = True
+    for obj in doc.Objects:
+        if obj.TypeId == 'Assembly::AssemblyObject':
+            result = obj.solve()
+            success = success and result in (None, 0)
+    return success
+
+# the target is moved through poses and solved without driving motors or recording states,
+# afterwards it gets its placement back and the assembly is solved again
+@contextlib.contextmanager
+def solving_offline(doc, target):
+    global immediate_send_enabled, recording_enabled
+    initial_placement = target.Placement
+    send_and_rec = immediate_send_enabled, recording_enabled
+    immediate_send_enabled, recording_enabled = False, False
+    try:
+        yield
+    finally:
+        target.Placement = initial_placement
+        solve_assemblies(doc)
+        send_scheduler.cancel() # observers requested sends while solving
+        immediate_send_enabled, recording_enabled = send_and_rec
+
+def set_ik_target(target, position):
+    target.Placement = App.Placement(App.Vector(*position), target.Placement.Rotation)
+
+# sample the workspace between lower and upper corners (mm) with steps points per axis, every point is solved once
+# target_label - object moved to every grid point, eg. 'PlatePosition' of the delta robot or 'GroundedSphereJoint' of the 3 axis arm
+# points are visited in a serpentine order, so every solve starts next to the previous solution
+def build_ik_table(target_label, lower, upper, steps = 10, path = None, doc = None):
+    global ik_table
+    doc = doc or App.ActiveDocument
+    target = doc.getObjectsByLabel(target_label)[0]
+    steps = [int(steps)] * 3 if np.isscalar(steps) else [int(n) for n in steps]
+    if min(steps) < 2:
+        App.Console.PrintError("At least 2 points per axis are needed\n")
+        return None
+    lower = np.asarray(lower, dtype = float)
+    step = (np.asarray(upper, dtype = float) - lower) / (np.array(steps) - 1)
+    observers = observer_registry.observers(doc)
+    states_for_send, targets = collect_states(observers) # the table keeps padded 3 motor groups, like sent states
+    angles = np.zeros(steps + [len(states_for_send)], dtype = np.float32)
+    valid = np.zeros(steps, dtype = bool)
+    start = time.perf_counter()
+    with solving_offline(doc, target):
+        for ix in range(steps[0]):
+            ys = range(steps[1]) if ix % 2 == 0 else reversed(range(steps[1]))
+            for row, iy in enumerate(ys):
+                zs = range(steps[2]) if (ix * steps[1] + row) % 2 == 0 else reversed(range(steps[2]))
+                for iz in zs:
+                    set_ik_target(target, lower + step * (ix, iy, iz))
+                    valid[ix, iy, iz] = solve_assemblies(doc)
+                    angles[ix, iy, iz] = [state[1] for state in collect_states(observers)[0]]
+    table = IKTable(lower, step, angles, [state[0] for state in states_for_send], valid, targets, {"target_label": target_label})
+    App.Console.PrintMessage("Solved " + str(valid.size) + " points in " + str(round(time.perf_counter() - start, 2)) + " s, "
+                             + str(int((~valid).sum())) + " failed\n")
+    if path:
+        table.save(path)
+    ik_table = table
+    return table
+
+def load_ik_table(path):
+    global ik_table
+    ik_table = IKTable.load(path)
+    App.Console.PrintMessage("Loaded " + repr(ik_table) + " from " + str(path) + "\n")
+    return ik_table
+
+# interpolation error against true solves at random points inside the table
+def ik_table_error(table = None, samples = 100, doc = None, steps_per_rev = None, seed = 0):
+    table = table or ik_table
+    doc = doc or App.ActiveDocument
+    target = doc.getObjectsByLabel(table.meta["target_label"])[0]
+    observers = observer_registry.observers(doc)
+    positions = table.origin + np.random.default_rng(seed).random((samples, 3)) * (table.upper() - table.origin)
+    interpolated = table.interpolate(positions)
+    solved = np.zeros_like(interpolated)
+    with solving_offline(doc, target):
+        for iden, position in enumerate(positions):
+            set_ik_target(target, position)
+            if not solve_assemblies(doc):
+                solved[iden] = np.nan
+                continue
+            solved[iden] = [state[1] for state in collect_states(observers)[0]]
+    errors = np.abs((interpolated - solved + 180.0) % 360.0 - 180.0)
+    errors = errors[~np.isnan(errors).any(axis = 1)]
+    if not len(errors):
+        App.Console.PrintError("No point could be compared\n")
+        return None
+    usteps_per_deg = motor_usteps_per_deg(observers, errors.shape[1], steps_per_rev)
+    report = {"points": len(errors), "mean": float(errors.mean()), "p99": float(np.percentile(errors, 99)), "max": float(errors.max()),
+              "max_per_motor": errors.max(axis = 0).tolist(), "max_usteps": float((errors * usteps_per_deg).max())}
+    App.Console.PrintMessage("IK table error at " + str(len(errors)) + " points: mean " + str(round(report["mean"], 4)) + " deg, p99 "
+                             + str(round(report["p99"], 4)) + " deg, max " + str(round(report["max"], 4)) + " deg ("
+                             + str(round(report["max_usteps"], 1)) + " usteps)\n")
+    return report
+
+# send angles interpolated for a target position, the assembly is not solved
+def ik_send(position, table = None):
+    table = table or ik_table
+    states_for_send = table.states(position)
+    if states_for_send is None:
+        App.Console.PrintWarning("Position " + str(list(position)) + " outside of the IK table\n")
+        return False
+    if recording_enabled:
+        recorded_states.append(states_for_send)
+        recorded_states.targets = table.targets
+    send_states_udp(states_for_send, table.targets)
+    return True
 
 def mo_help():
     App.Console.PrintMessage("Type: adr='127.0.0.1' to use local machine as target or adr='192.168.1.23', where '192.168.1.23' is the IP adress of your remote machine \n Type: sock.close() to close the connection \n Type: create_observer() to create a new MotorObserver object \n Type: set_base_pl() to set initial placement of observers \n")
-    App.Console.PrintMessage("Type: record_states(True) to START recording movement \n Type: record_states(False) to STOP recording movement \n Type: replay_states(200) to replay movement with 200ms interval \n")
+    App.Console.PrintMessage("Type: record_states(True) to START recording movement \n Type: record_states(False) to STOP recording movement \n Type: replay_states() to replay movement with recorded timing \n Type: replay_states(200) to replay movement with 200ms interval \n")
+    App.Console.PrintMessage("Type: replay_states(100, speed=2.0, loop=True) to replay twice as fast in a loop \n Type: replay_pause(), replay_resume(), replay_seek(0), replay_speed(0.5) or replay_stop() to control the replay \n Type: replay_stats() to check replay timing \n Type: decimate_states(1.0) to drop states differing less than 1 microstep \n")
+    App.Console.PrintMessage("Type: record_states(True, max_frames=10000) to keep only the newest 10000 states \n Type: save_states('/path/file.motraj') to save recorded states \n Type: load_states('/path/file.motraj') to load states for replay \n")
+    App.Console.PrintMessage("Set ReceiverAddress and ReceiverPort of observers to drive more than 3 motors, every receiver gets a group of up to 3 motors \n")
+    App.Console.PrintMessage("Type: set_batch_angles(True) to calculate angles of all observers in one pass \n Type: benchmark_angles() to compare per-object and batch angle calculation \n")
+    App.Console.PrintMessage("Type: set_send_rate(20, 500) to send at most every 20 ms and at least every 500 ms \n Type: send_stats() to show sent, coalesced and suppressed states, set Deadband of observers to skip small changes \n")
+    App.Console.PrintMessage("Type: set_wire_protocol(2, chunk=10) to send versioned datagrams with sequence numbers and 10 setpoints per replay datagram, set_wire_protocol(1) restores the udp_receiver format \n Type: set_wire_protocol(2, continuous=True, velocity=True) to send multi-turn angles and velocities of observers \n")
+    App.Console.PrintMessage("Type: simulate_states() to dry run recorded states on a simulated udp_receiver, eg. simulate_states(steps_per_rev=200, max_degs_per_second=720) \n")
+    App.Console.PrintMessage("Type: build_ik_table('PlatePosition', (-50, -50, -150), (50, 50, -100), 10, '/path/delta.iktable') to solve a grid of positions once \n Type: ik_table_error() to compare interpolated and solved angles, ik_send((0, 0, -120)) to send interpolated angles without solving \n")
+    App.Console.PrintMessage("Type: set_network_thread(False) to send from the GUI thread, set_network_thread(True, min_interval=0.02) to send from the network thread at most every 20 ms \n")
+    App.Console.PrintMessage("Type: mo_stats() to show send latency histograms, mo_stats(csv_path='/path/stats.csv') to export them \n Type: set_log_level(2) to print every state and send, set_log_level(0) to print only warnings and errors \n")
 
 if (platform.machine() == 'armv7l') or (platform.machine() == 'aarch64'): # assumes running on Pi that drives steppers directly
     adr = '127.0.0.1'
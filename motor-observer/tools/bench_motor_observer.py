@@ -0,0 +1,228 @@
+# Headless benchmark of the motor-observer.py send path, runs without FreeCAD, Qt and Raspberry Pi
+# FreeCAD is replaced by fc_stubs.py, udp_receiver by a receiver thread decoding the same State structure
+# Usage:
+# python bench_motor_observer.py                          # all benchmarks, JSON results on stdout
+# python bench_motor_observer.py --quick -o results.json  # fewer observers and shorter runs
+# python bench_motor_observer.py --baseline results.json  # exit code 1 if any result is more than 25% slower
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2024 Adrian Przekwas adrian.v.przekwas@gmail.com        *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 3 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import argparse
+import json
+import platform
+import socket
+import sys
+import threading
+import time
+
+import fc_stubs
+from udp_sink import decode_state, state_size
+
+App = fc_stubs.install()
+mo = fc_stubs.load_motor_observer()
+bench_port = 7799
+
+# receives datagrams sent by motor-observer.py and notes their arrival time
+class Receiver(threading.Thread):
+    def __init__(self, port):
+        threading.Thread.__init__(self, daemon = True)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.sock.bind(("", port)) # all loopback addresses, one per motor group
+        self.sock.settimeout(0.1)
+        self.arrivals = []
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                data = self.sock.recv(2048)
+            except socket.timeout:
+                continue
+            if len(data) == state_size:
+                self.arrivals.append((time.perf_counter(), decode_state(data)[0][1]))
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.sock.close()
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))] if values else 0.0
+
+documents = 0
+
+# a new document with count observers, every group of 3 observers goes to its own loopback address
+def make_document(count):
+    global documents
+    documents += 1
+    App.newDocument("Bench" + str(documents))
+    for iden in range(count):
+        mo["create_observer"]()
+    observers = mo["observer_registry"].observers()
+    for iden, obs in enumerate(observers):
+        group = iden // 3
+        obs.ReceiverAddress = "127.0." + str(group // 250) + "." + str(group % 250 + 1)
+        obs.ReceiverPort = bench_port
+    mo["set_base_pl"]()
+    return observers
+
+def rotate(observers, angle):
+    placement = App.Placement(App.Vector(), App.Rotation(App.Vector(0, 0, 1), angle))
+    for obs in observers:
+        obs.Placement = placement
+
+# cost of MotorObserver.onChanged for a Placement change, per observer
+def bench_onchanged(count, repeats, batch):
+    observers = make_document(count)
+    mo["set_batch_angles"](batch)
+    mo["send_scheduler"].cancel()
+    start = time.perf_counter()
+    for rep in range(repeats):
+        rotate(observers, rep % 360 + 0.5)
+    elapsed = time.perf_counter() - start
+    mo["send_scheduler"].cancel()
+    mo["set_batch_angles"](False)
+    return {"benchmark": "onchanged", "observers": count, "batch": batch, "us_per_call": elapsed / (repeats * count) * 1e6}
+
+# send_states() calls per second, every call has changed angles, so nothing is suppressed
+def bench_send_states(count, repeats):
+    observers = make_document(count)
+    start = time.perf_counter()
+    for rep in range(repeats):
+        for obs in observers:
+            obs.TransfAngle = str((rep % 2) * 0.1) + "rad"
+        mo["send_states"]()
+    elapsed = time.perf_counter() - start
+    return {"benchmark": "send_states", "observers": count, "calls_per_s": repeats / elapsed, "us_per_call": elapsed / repeats * 1e6}
+
+# send_states_udp() cost on the calling (GUI) thread with the network thread, packing and sending without it
+def bench_send_udp(count, repeats):
+    groups = max(1, (count + 2) // 3)
+    states = [[True, float(iden)] for iden in range(groups * 3)]
+    targets = [("127.0." + str(group // 250) + "." + str(group % 250 + 1), bench_port) for group in range(groups)]
+    start = time.perf_counter()
+    for rep in range(repeats):
+        mo["send_states_udp"](states, targets)
+    publish_time = (time.perf_counter() - start) / repeats
+    sock = mo["sock"]
+    mo["sock"] = None # packing only
+    start = time.perf_counter()
+    for rep in range(repeats):
+        mo["transmit_states_udp"](states, targets)
+    pack_time = (time.perf_counter() - start) / repeats
+    mo["sock"] = sock
+    start = time.perf_counter()
+    for rep in range(repeats):
+        mo["transmit_states_udp"](states, targets)
+    send_time = (time.perf_counter() - start) / repeats
+    return {"benchmark": "send_states_udp", "observers": count, "groups": groups, "publish_us": publish_time * 1e6,
+            "pack_us": pack_time * 1e6, "pack_and_send_us": send_time * 1e6}
+
+# observers are rotated at input_rate, sends go through the scheduler to the receiver thread
+# latency is measured from the rotation whose angle arrived in the datagram
+def bench_end_to_end(count, send_rate, duration, receiver, input_rate = 200):
+    observers = make_document(count)
+    mo["set_send_rate"](1000.0 / send_rate, 0)
+    mo["send_scheduler"].reset_counters()
+    del receiver.arrivals[:]
+    changes = {}
+    step = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        step += 1
+        angle = round(step * 0.01 % 360, 2)
+        changes[angle] = time.perf_counter()
+        rotate(observers, angle)
+        fc_stubs.process_events(1.0 / input_rate)
+    fc_stubs.process_events(0.1) # the last scheduled send
+    elapsed = time.perf_counter() - start
+    mo["send_scheduler"].cancel()
+    latencies = [arrival - changes[round(angle, 2)] for arrival, angle in list(receiver.arrivals) if round(angle, 2) in changes]
+    scheduler = mo["send_scheduler"]
+    groups = max(1, (count + 2) // 3)
+    return {"benchmark": "end_to_end", "observers": count, "send_rate_hz": send_rate, "achieved_send_rate_hz": scheduler.sends / elapsed,
+            "datagrams": len(latencies), "expected_datagrams": scheduler.sends * groups,
+            "latency_p50_ms": percentile(latencies, 50) * 1000, "latency_p99_ms": percentile(latencies, 99) * 1000,
+            "latency_max_ms": max(latencies) * 1000 if latencies else 0.0}
+
+# lower is better for costs and latencies, higher for rates
+def regressions(results, baseline, tolerance):
+    found = []
+    keys = ("benchmark", "observers", "batch", "send_rate_hz")
+    old = {tuple(res.get(key) for key in keys): res for res in baseline["results"]}
+    for res in results:
+        ref = old.get(tuple(res.get(key) for key in keys))
+        if not ref:
+            continue
+        for metric, value in res.items():
+            if metric in keys or not isinstance(value, float) or not isinstance(ref.get(metric), float) or ref[metric] <= 0:
+                continue
+            higher_is_better = metric.endswith("_per_s") or metric.endswith("_hz")
+            ratio = ref[metric] / value if higher_is_better else value / ref[metric]
+            if value > 0 and ratio > 1 + tolerance:
+                found.append(res["benchmark"] + " " + str(res["observers"]) + " observers " + metric + ": " + str(round(ref[metric], 3)) + " -> " + str(round(value, 3)))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark of motor-observer.py without FreeCAD")
+    parser.add_argument("--quick", action = "store_true", help = "fewer observers and shorter runs")
+    parser.add_argument("-o", "--output", help = "write JSON results to a file instead of stdout")
+    parser.add_argument("--baseline", help = "JSON results to compare with")
+    parser.add_argument("--tolerance", type = float, default = 0.25, help = "allowed slowdown against the baseline")
+    args = parser.parse_args()
+    counts = (1, 10, 100) if args.quick else (1, 10, 100, 1000)
+    send_rates = (20, 50) if args.quick else (10, 20, 50, 100)
+    duration = 0.5 if args.quick else 2.0
+    mo["set_log_level"](0)
+    receiver = Receiver(bench_port)
+    receiver.start()
+    results = []
+    for count in counts:
+        repeats = max(3, 2000 // count)
+        results.append(bench_onchanged(count, repeats, False))
+        results.append(bench_onchanged(count, repeats, True))
+        results.append(bench_send_states(count, repeats))
+        results.append(bench_send_udp(count, repeats))
+        for send_rate in send_rates:
+            results.append(bench_end_to_end(count, send_rate, duration, receiver))
+        sys.stderr.write(str(count) + " observers done\n")
+    receiver.stop()
+    report = {"python": platform.python_version(), "machine": platform.machine(), "time": time.time(), "results": results}
+    text = json.dumps(report, indent = 1)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            sys.stderr.write("Regression: " + line + "\n")
+        return 1 if found else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
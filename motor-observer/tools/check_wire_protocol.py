@@ -0,0 +1,179 @@
+# Round trip check of wire protocol 2 of motor-observer.py, runs without FreeCAD like bench_motor_observer.py
+# Datagrams encoded by motor-observer.py are decoded by its own decoder and by the receiver emulator in udp_sink.py,
+# then a replay with chunked setpoints is sent over loopback to the emulator, which executes setpoints at their offsets
+# Usage:
+# python check_wire_protocol.py    # exit code 1 if any check fails
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2024 Adrian Przekwas adrian.v.przekwas@gmail.com        *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 3 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+import fc_stubs
+import udp_sink
+
+App = fc_stubs.install()
+mo = fc_stubs.load_motor_observer()
+check_port = 7798
+failures = []
+
+def check(condition, msg):
+    if not condition:
+        failures.append(msg)
+        print("FAILED: " + msg)
+
+def float32(value):
+    return struct.unpack("<f", struct.pack("<f", value))[0]
+
+def same_setpoints(decoded, setpoints):
+    if len(decoded) != len(setpoints):
+        return False
+    for (offset0, states0), (offset1, states1) in zip(decoded, setpoints):
+        if offset0 != float32(offset1):
+            return False
+        if [[bool(state[0])] + state[1:] for state in states0] != [[bool(state[0])] + [float32(value) for value in state[1:]] for state in states1]:
+            return False
+    return True
+
+def check_round_trip():
+    rng = random.Random(1)
+    for motor_count, flags in ((1, 0), (3, 0), (7, 0), (32, 0), (3, mo["wire_flag_velocity"]), (32, mo["wire_flag_velocity"] | mo["wire_flag_continuous"])):
+        for count in (0, 1, 2, mo["wire_chunk_limit"](motor_count, flags)):
+            extra = 1 if flags & mo["wire_flag_velocity"] else 0
+            setpoints = [(iden * 0.02, [[rng.random() < 0.5, rng.uniform(-3600, 3600)] + [rng.uniform(-500, 500)] * extra for motor in range(motor_count)])
+                         for iden in range(count)]
+            sequence = rng.getrandbits(32)
+            data = mo["encode_v2"](setpoints, sequence, 1234.5, motor_count, flags = flags)
+            check(len(data) <= mo["wire_max_size"], "datagram of " + str(count) + " setpoints is larger than " + str(mo["wire_max_size"]) + " bytes")
+            for name, decode in (("motor-observer.py", mo["decode_v2"]), ("udp_sink.py", udp_sink.decode_v2)):
+                packet = decode(data)
+                check(packet["sequence"] == sequence and packet["timestamp"] == 1234.5 and packet["motor_count"] == motor_count
+                      and packet["sender_id"] == mo["wire_sender_id"] and packet["flags"] == flags, name + " header of " + str(motor_count) + " motors")
+                check(same_setpoints(packet["setpoints"], setpoints), name + " setpoints of " + str(motor_count) + " motors, " + str(count) + " setpoints")
+    legacy = struct.pack("?f?f?f", True, 1.0, False, 2.0, True, 3.0)
+    check(mo["decode_v2"](legacy) is None and udp_sink.decode_v2(legacy) is None, "legacy datagram taken for protocol 2")
+    data = mo["encode_v2"]([(0.0, [[True, 1.0]] * 3)], 0)
+    for damaged in (data[:-1], data[:2] + b"\x07" + data[3:]):
+        try:
+            udp_sink.decode_v2(damaged)
+            check(False, "damaged datagram accepted")
+        except ValueError:
+            pass
+
+def check_sequences():
+    emulator = udp_sink.ReceiverEmulator()
+    datagrams = [mo["encode_v2"]([(0.0, [[True, float(iden)]] * 3)], iden, sender_id = 7) for iden in range(10)]
+    for iden in (0, 1, 3, 2, 4, 4, 5, 6, 8, 9):
+        emulator.receive(datagrams[iden])
+    check(emulator.lost == 1 and emulator.reordered == 1 and emulator.duplicated == 1,
+          "lost " + str(emulator.lost) + ", reordered " + str(emulator.reordered) + ", duplicated " + str(emulator.duplicated) + ", expected 1, 1, 1")
+
+class EmulatorThread(threading.Thread):
+    def __init__(self, port):
+        threading.Thread.__init__(self, daemon = True)
+        self.emulator = udp_sink.ReceiverEmulator(sender_clock = True) # same machine, timing of the sender is checked
+        self.emulator.keep_executed = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", port))
+        self.sock.settimeout(0.001)
+        self.lock = threading.Lock()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+                with self.lock:
+                    self.emulator.receive(data)
+            except socket.timeout:
+                pass
+            with self.lock:
+                self.emulator.poll()
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.sock.close()
+
+# a replay of chunked setpoints is executed by the emulator with the recorded timing
+def check_replay(chunk = 5, frames = 40, period = 0.02):
+    receiver = EmulatorThread(check_port)
+    receiver.start()
+    store = mo["TrajectoryStore"]()
+    for iden in range(frames):
+        store.append([[True, float(iden)], [True, iden * 2.0], [False, 0.0]], iden * period)
+    store.targets = [("127.0.0.1", check_port)]
+    mo["set_wire_protocol"](2, chunk)
+    player = mo["ReplayPlayer"](store)
+    player.start()
+    player.thread.join(frames * period + 2.0)
+    time.sleep(chunk * period + 0.05)
+    receiver.stop()
+    mo["set_wire_protocol"](1)
+    emulator = receiver.emulator
+    executed = emulator.executed
+    check(emulator.datagrams == (frames + chunk - 1) // chunk, str(emulator.datagrams) + " datagrams for " + str(frames) + " frames in chunks of " + str(chunk))
+    check([states[0][1] for due, states in executed] == [float(iden) for iden in range(frames)], "replayed frames executed out of order or lost")
+    check(emulator.lost == 0 and emulator.reordered == 0, "lost or reordered datagrams on loopback")
+    if len(executed) == frames:
+        errors = [abs((due - executed[0][0]) - iden * period) for iden, (due, states) in enumerate(executed)]
+        check(max(errors) < 0.01, "setpoint timing error " + str(round(max(errors) * 1000, 2)) + " ms")
+        print("Replay: " + str(frames) + " frames in " + str(emulator.datagrams) + " datagrams, max timing error "
+              + str(round(max(errors) * 1000, 2)) + " ms")
+
+# a looped replay starts again after the last buffered frame, so no frame of the last chunk is replaced by the next loop
+def check_loop(chunk = 5, frames = 10, period = 0.02, loops = 3):
+    receiver = EmulatorThread(check_port)
+    receiver.start()
+    store = mo["TrajectoryStore"]()
+    for iden in range(frames):
+        store.append([[True, float(iden)], [True, 0.0], [True, 0.0]], iden * period)
+    store.targets = [("127.0.0.1", check_port)]
+    mo["set_wire_protocol"](2, chunk)
+    player = mo["ReplayPlayer"](store, loop = True)
+    player.start()
+    time.sleep(loops * frames * period + period / 2) # into the first frame of the next loop
+    player.stop()
+    player.thread.join(1.0)
+    time.sleep(chunk * period + 0.05)
+    receiver.stop()
+    mo["set_wire_protocol"](1)
+    executed = [states[0][1] for due, states in receiver.emulator.executed]
+    check(executed[:loops * frames] == [float(iden) for iden in range(frames)] * loops, "looped replay executed " + str(executed))
+    print("Looped replay: " + str(len(executed)) + " frames executed in " + str(loops) + " loops of " + str(frames))
+
+def main():
+    mo["set_log_level"](0)
+    check_round_trip()
+    check_sequences()
+    check_replay()
+    check_loop()
+    print("Wire protocol check " + ("failed" if failures else "passed"))
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+# Minimal stand-ins for FreeCAD, Part and PySide2.QtCore, just enough to run motor-observer.py without FreeCAD
+# Rotation follows Base::Rotation (quaternion x, y, z, w, Hamilton product, Axis and Angle evaluation),
+# so angles calculated by MotorObserver match the ones calculated inside FreeCAD
+# Used by bench_motor_observer.py, timers are fired by process_events() instead of the Qt event loop
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2024 Adrian Przekwas adrian.v.przekwas@gmail.com        *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 3 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import math
+import os
+import re
+import sys
+import time
+import types
+
+class Console:
+    def __init__(self):
+        self.echo = False
+        self.messages = []
+
+    def write(self, kind, msg):
+        self.messages.append((kind, msg))
+        del self.messages[:-1000]
+        if self.echo:
+            sys.stdout.write(msg)
+
+    def PrintMessage(self, msg):
+        self.write("Message", msg)
+
+    def PrintWarning(self, msg):
+        self.write("Warning", msg)
+
+    def PrintError(self, msg):
+        self.write("Error", msg)
+
+    def PrintLog(self, msg):
+        self.write("Log", msg)
+
+class Vector:
+    def __init__(self, x = 0.0, y = 0.0, z = 0.0):
+        if isinstance(x, (list, tuple)):
+            x, y, z = x
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def __add__(self, other):
+        return Vector(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return Vector(self.x - other.x, self.y - other.y, self.z - other.z)
+
+    def __mul__(self, k):
+        return Vector(self.x * k, self.y * k, self.z * k)
+
+    def __getitem__(self, iden):
+        return (self.x, self.y, self.z)[iden]
+
+    @property
+    def Length(self):
+        return math.sqrt(self.x * self.x + self.y * self.y + self.z * self.z)
+
+    def __repr__(self):
+        return "Vector (" + str(self.x) + ", " + str(self.y) + ", " + str(self.z) + ")"
+
+class Rotation:
+    def __init__(self, *args):
+        self._axis = Vector(0, 0, 1)
+        if not args:
+            quat = (0.0, 0.0, 0.0, 1.0)
+        elif len(args) == 4:
+            quat = args
+        elif len(args) == 2: # axis, angle in degrees
+            axis, angle = args
+            half = math.radians(angle) / 2
+            length = axis.Length
+            quat = (axis.x / length * math.sin(half), axis.y / length * math.sin(half), axis.z / length * math.sin(half), math.cos(half))
+        elif len(args) == 1 and isinstance(args[0], Rotation):
+            quat = args[0].Q
+        else:
+            raise TypeError("unsupported Rotation arguments")
+        self.setValue(*quat)
+
+    def setValue(self, x, y, z, w):
+        norm = math.sqrt(x * x + y * y + z * z + w * w)
+        self.Q = (x / norm, y / norm, z / norm, w / norm)
+        x, y, z, w = self.Q
+        if -1.0 < w < 1.0: # Base::Rotation::evaluateVector()
+            angle = math.acos(w) * 2.0
+            scale = math.sin(angle / 2.0)
+            length = self._axis.Length or 1.0
+            self._axis = Vector(x * length / scale, y * length / scale, z * length / scale)
+            self._angle = angle
+        else:
+            self._axis = Vector(0, 0, 1)
+            self._angle = 0.0
+
+    @property
+    def Axis(self):
+        return self._axis
+
+    @property
+    def Angle(self):
+        return self._angle
+
+    def inverted(self):
+        x, y, z, w = self.Q
+        return Rotation(-x, -y, -z, w)
+
+    def __mul__(self, other):
+        x0, y0, z0, w0 = self.Q
+        x1, y1, z1, w1 = other.Q
+        return Rotation(w0 * x1 + x0 * w1 + y0 * z1 - z0 * y1,
+                        w0 * y1 - x0 * z1 + y0 * w1 + z0 * x1,
+                        w0 * z1 + x0 * y1 - y0 * x1 + z0 * w1,
+                        w0 * w1 - x0 * x1 - y0 * y1 - z0 * z1)
+
+class Placement:
+    def __init__(self, base = None, rotation = None):
+        self.Base = base if base is not None else Vector()
+        self.Rotation = rotation if rotation is not None else Rotation()
+
+class Quantity:
+    def __init__(self, value):
+        if isinstance(value, str): # eg. '1.5rad', stored in degrees like App::PropertyAngle
+            match = re.match(r"\s*([-+0-9.eE]+)\s*(rad|deg)?", value)
+            value = math.degrees(float(match.group(1))) if match.group(2) == "rad" else float(match.group(1))
+        self.Value = float(value)
+
+property_defaults = {
+    "App::PropertyAngle": lambda: Quantity(0.0),
+    "App::PropertyRotation": Rotation,
+    "App::PropertyPlacement": Placement,
+    "App::PropertyBool": lambda: False,
+    "App::PropertyInteger": lambda: 0,
+    "App::PropertyFloat": lambda: 0.0,
+    "App::PropertyString": lambda: "",
+    "App::PropertyLink": lambda: None,
+}
+
+class DocumentObject:
+    def __init__(self, doc, name, type_id):
+        self.__dict__.update(Document = doc, Name = name, TypeId = type_id, Proxy = None, ViewObject = types.SimpleNamespace(Proxy = None),
+                             properties = {"Label": name, "Placement": Placement()}, property_types = {})
+
+    def addProperty(self, type_id, name, group = "", doc = ""):
+        self.property_types[name] = type_id
+        self.properties[name] = property_defaults[type_id]()
+        return self
+
+    @property
+    def PropertiesList(self):
+        return list(self.properties)
+
+    def getPropertyByName(self, name):
+        return self.properties[name]
+
+    def setEditorMode(self, name, mode):
+        pass
+
+    def recompute(self):
+        if self.Proxy is not None and hasattr(self.Proxy, "execute"):
+            self.Proxy.execute(self)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__["properties"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in ("Proxy", "Shape"):
+            self.__dict__[name] = value
+            return
+        if name not in self.properties:
+            raise AttributeError(name)
+        if self.property_types.get(name) == "App::PropertyAngle":
+            value = Quantity(value)
+        self.properties[name] = value
+        if self.Proxy is not None and hasattr(self.Proxy, "onChanged"):
+            self.Proxy.onChanged(self, name)
+        signal("slotChangedObject", self, name)
+
+class Document:
+    def __init__(self, name):
+        self.Name = name
+        self.FileName = ""
+        self.Objects = []
+
+    def addObject(self, type_id, name):
+        unique = name
+        count = 0
+        while self.getObject(unique):
+            count += 1
+            unique = name + str(count).zfill(3)
+        obj = DocumentObject(self, unique, type_id)
+        self.Objects.append(obj)
+        signal("slotCreatedObject", obj)
+        return obj
+
+    def getObject(self, name):
+        for obj in self.Objects:
+            if obj.Name == name:
+                return obj
+        return None
+
+    def removeObject(self, name):
+        obj = self.getObject(name)
+        signal("slotDeletedObject", obj)
+        self.Objects.remove(obj)
+
+    def findObjects(self, Type = None, Name = None, Label = None):
+        return [obj for obj in self.Objects if (Label is None or re.search(Label, obj.Label)) and (Name is None or re.search(Name, obj.Name))]
+
+    def getObjectsByLabel(self, label):
+        return [obj for obj in self.Objects if obj.Label == label]
+
+    def recompute(self):
+        pass
+
+document_observers = []
+
+def signal(slot, *args):
+    for observer in list(document_observers):
+        if hasattr(observer, slot):
+            getattr(observer, slot)(*args)
+
+# Qt timers, fired by process_events()
+timers = []
+
+class Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+class QTimer:
+    def __init__(self, parent = None):
+        self.timeout = Signal()
+        self.single_shot = False
+        self.interval_ms = 0
+        self.due = None
+        timers.append(self)
+
+    def setSingleShot(self, single_shot):
+        self.single_shot = single_shot
+
+    def setInterval(self, interval):
+        self.interval_ms = int(interval)
+
+    def interval(self):
+        return self.interval_ms
+
+    def setTimerType(self, timer_type):
+        pass
+
+    def isActive(self):
+        return self.due is not None
+
+    def start(self, interval = None):
+        if interval is not None:
+            self.interval_ms = int(interval)
+        self.due = time.monotonic() + self.interval_ms / 1000
+
+    def stop(self):
+        self.due = None
+
+def process_events(duration = 0.0):
+    end = time.monotonic() + duration
+    while True:
+        now = time.monotonic()
+        for timer in list(timers):
+            if timer.due is not None and timer.due <= now:
+                timer.due = None if timer.single_shot else now + timer.interval_ms / 1000
+                timer.timeout.emit()
+        if now >= end:
+            break
+        due = [timer.due for timer in timers if timer.due is not None]
+        time.sleep(max(0.0, min(due + [end]) - time.monotonic()) if due else max(0.0, end - now))
+
+def install():
+    app = types.ModuleType("FreeCAD")
+    app.Console = Console()
+    app.Vector = Vector
+    app.Rotation = Rotation
+    app.Placement = Placement
+    app.GuiUp = False
+    app.ActiveDocument = None
+    app.addDocumentObserver = document_observers.append
+    app.removeDocumentObserver = document_observers.remove
+    def newDocument(name = "Unnamed"):
+        app.ActiveDocument = Document(name)
+        return app.ActiveDocument
+    app.newDocument = newDocument
+    part = types.ModuleType("Part")
+    part.makeBox = lambda *args: ("Box", args)
+    pyside = types.ModuleType("PySide2")
+    qtcore = types.ModuleType("PySide2.QtCore")
+    qtcore.QTimer = QTimer
+    pyside.QtCore = qtcore
+    sys.modules.update({"FreeCAD": app, "Part": part, "PySide2": pyside, "PySide2.QtCore": qtcore})
+    return app
+
+# executes motor-observer.py like pasting it into the FreeCAD console, returns its namespace
+def load_motor_observer(path = None):
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "motor-observer.py")
+    namespace = {"__name__": "__main__"}
+    with open(path) as f:
+        exec(compile(f.read(), path, "exec"), namespace)
+    return namespace
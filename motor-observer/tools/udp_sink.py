@@ -0,0 +1,198 @@
+# A stand-in for udp_receiver on a machine without GPIO, it decodes the same 24 byte State structure
+# Run one sink per receiver group, eg. for 3 groups:
+# python udp_sink.py 7755 & python udp_sink.py 7756 & python udp_sink.py 7757
+# and set ReceiverAddress to 127.0.0.1 and ReceiverPort to 7755, 7756, 7757 on the observers
+# Every report_interval seconds the sink prints packet rate and inter-arrival jitter
+# It also emulates a receiver of wire protocol 2 (set_wire_protocol(2) in motor-observer.py): sequence numbers are checked
+# for lost, reordered and duplicated datagrams and timed setpoints are buffered and executed at their offsets
+
+# ***************************************************************************
+# *                                                                         *
+# *   Copyright (c) 2024 Adrian Przekwas adrian.v.przekwas@gmail.com        *
+# *                                                                         *
+# *   This program is free software; you can redistribute it and/or modify  *
+# *   it under the terms of the GNU Lesser General Public License (LGPL)    *
+# *   as published by the Free Software Foundation; either version 3 of     *
+# *   the License, or (at your option) any later version.                   *
+# *   for detail see the LICENCE text file.                                 *
+# *                                                                         *
+# *   This program is distributed in the hope that it will be useful,       *
+# *   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+# *   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+# *   GNU Library General Public License for more details.                  *
+# *                                                                         *
+# *   You should have received a copy of the GNU Library General Public     *
+# *   License along with this program; if not, write to the Free Software   *
+# *   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+# *   USA                                                                   *
+# *                                                                         *
+# ***************************************************************************
+
+import socket
+import struct
+import sys
+import time
+
+state_format = "?f?f?f" # struct State in udp_receiver.cpp
+state_size = struct.calcsize(state_format) # 24 bytes
+
+# wire protocol 2, same as in motor-observer.py
+wire_magic = b"MO"
+wire_version = 2
+wire_header_format = "<2sBBIIdBBxx" # magic, version, flags, sender id, sequence, timestamp (s), motor count, setpoint count
+wire_header_size = struct.calcsize(wire_header_format)
+wire_flag_continuous = 1 # multi-turn angles
+wire_flag_velocity = 2 # velocities (deg/s) follow the angles
+
+def decode_state(data):
+    values = struct.unpack(state_format, data[:state_size])
+    return [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
+
+# returns None for legacy datagrams, raises ValueError for damaged ones
+def decode_v2(data):
+    if len(data) < wire_header_size or data[:2] != wire_magic:
+        return None
+    magic, version, flags, sender_id, sequence, timestamp, motor_count, count = struct.unpack_from(wire_header_format, data)
+    if version != wire_version:
+        raise ValueError("unsupported protocol version " + str(version))
+    setpoint_format = "<fI" + "f" * (motor_count * 2 if flags & wire_flag_velocity else motor_count)
+    size = struct.calcsize(setpoint_format)
+    if len(data) != wire_header_size + size * count:
+        raise ValueError("datagram size " + str(len(data)) + " does not match " + str(count) + " setpoints of " + str(motor_count) + " motors")
+    setpoints = []
+    for iden in range(count):
+        values = struct.unpack_from(setpoint_format, data, wire_header_size + iden * size)
+        states = [[bool(values[1] >> motor & 1), values[2 + motor]] for motor in range(motor_count)]
+        if flags & wire_flag_velocity:
+            for motor, state in enumerate(states):
+                state.append(values[2 + motor_count + motor])
+        setpoints.append((values[0], states))
+    return {"version": version, "flags": flags, "sender_id": sender_id, "sequence": sequence, "timestamp": timestamp,
+            "motor_count": motor_count, "setpoints": setpoints}
+
+# what a receiver of both protocols does with datagrams, without driving motors
+# legacy datagrams are executed on arrival, protocol 2 setpoints are executed at arrival + offset
+# a datagram replaces buffered setpoints from its first setpoint on, a datagram without setpoints drops the buffer
+# sender_clock - setpoints are due at the sender timestamp + offset, for synchronized clocks or a sender on the same machine
+class ReceiverEmulator:
+    def __init__(self, sender_clock = False):
+        self.sender_clock = sender_clock
+        self.senders = {} # sender id: next expected sequence
+        self.buffer = [] # (due, states), sorted by due
+        self.executed = [] # (time, states) of executed setpoints, when keep_executed is set
+        self.keep_executed = False
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.datagrams = 0
+        self.legacy = 0
+        self.setpoints = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicated = 0
+        self.damaged = 0
+        self.latencies = [] # sender timestamp to arrival, meaningful with synchronized clocks
+
+    def receive(self, data, arrival = None):
+        arrival = time.time() if arrival is None else arrival
+        self.datagrams += 1
+        try:
+            packet = decode_v2(data)
+        except ValueError:
+            self.damaged += 1
+            return None
+        if packet is None:
+            if len(data) != state_size:
+                self.damaged += 1
+                return None
+            self.legacy += 1
+            self.execute(arrival, decode_state(data))
+            return None
+        expected = self.senders.get(packet["sender_id"])
+        sequence = packet["sequence"]
+        if expected is not None and sequence != expected:
+            gap = (sequence - expected) & 0xFFFFFFFF
+            if gap < 0x80000000:
+                self.lost += gap
+            elif sequence == (expected - 1) & 0xFFFFFFFF:
+                self.duplicated += 1
+                return packet
+            else: # older than the newest datagram, its setpoints are outdated
+                self.reordered += 1
+                self.lost = max(0, self.lost - 1)
+                return packet
+        self.senders[packet["sender_id"]] = (sequence + 1) & 0xFFFFFFFF
+        self.latencies.append(arrival - packet["timestamp"])
+        start = packet["timestamp"] if self.sender_clock else arrival
+        setpoints = [(start + offset, states) for offset, states in packet["setpoints"]]
+        self.setpoints += len(setpoints)
+        if setpoints:
+            self.buffer = [item for item in self.buffer if item[0] < setpoints[0][0]] + setpoints
+        else:
+            self.buffer = []
+        self.poll(arrival)
+        return packet
+
+    def poll(self, now = None): # executes due setpoints, returns the number of buffered ones
+        now = time.time() if now is None else now
+        while self.buffer and self.buffer[0][0] <= now:
+            due, states = self.buffer.pop(0)
+            self.execute(due, states)
+        return len(self.buffer)
+
+    def execute(self, due, states):
+        if self.keep_executed:
+            self.executed.append((due, states))
+
+def run_sink(port = 7755, report_interval = 1.0, verbose = False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", port))
+    sock.settimeout(0.01)
+    print("Listening on port " + str(port))
+    emulator = ReceiverEmulator()
+    intervals = []
+    last_arrival = None
+    last_report = time.monotonic()
+    while True:
+        try:
+            data = sock.recv(65536)
+            arrival = time.monotonic()
+            packet = emulator.receive(data)
+            if last_arrival is not None:
+                intervals.append(arrival - last_arrival)
+            last_arrival = arrival
+            if verbose:
+                if packet:
+                    print("Sender " + str(packet["sender_id"]) + " sequence " + str(packet["sequence"]) + ", " + str(len(packet["setpoints"])) + " setpoints")
+                    setpoints = packet["setpoints"]
+                elif len(data) == state_size:
+                    setpoints = [(0.0, decode_state(data))]
+                else:
+                    print("Unexpected packet size: " + str(len(data)))
+                    setpoints = []
+                for offset, state in setpoints:
+                    for iden, values in enumerate(state):
+                        print("+" + str(round(offset * 1000, 1)) + " ms Motor " + str(iden) + " enabled: " + str(int(values[0])) + ", Angle: " + str(values[1])
+                              + (", Velocity: " + str(values[2]) if len(values) > 2 else ""))
+        except socket.timeout:
+            pass
+        buffered = emulator.poll()
+        now = time.monotonic()
+        if now - last_report >= report_interval:
+            if intervals:
+                mean = sum(intervals) / len(intervals)
+                jitter = (sum((i - mean) ** 2 for i in intervals) / len(intervals)) ** 0.5
+                print("Port " + str(port) + ": " + str(round(emulator.datagrams / (now - last_report), 1)) + " packets/s, mean interval "
+                      + str(round(mean * 1000, 2)) + " ms, jitter " + str(round(jitter * 1000, 3)) + " ms")
+            if emulator.datagrams > emulator.legacy:
+                print("  protocol 2: " + str(round(emulator.setpoints / (now - last_report), 1)) + " setpoints/s, buffered " + str(buffered)
+                      + ", lost " + str(emulator.lost) + ", reordered " + str(emulator.reordered) + ", duplicated " + str(emulator.duplicated)
+                      + ", damaged " + str(emulator.damaged))
+            emulator.reset_counters()
+            intervals = []
+            last_report = now
+
+if __name__ == "__main__":
+    verbose = "-v" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "-v"]
+    run_sink(int(args[0]) if args else 7755, verbose = verbose)